@@ -0,0 +1,227 @@
+#Headless benchmarks for Scene Nodes. Runs inside Blender without a UI:
+#
+#   blender -b --factory-startup --python benchmark.py -- --size 1000
+#
+#Each scenario builds a synthetic scene, graphs it and reports the wall time,
+#node/link counts and peak Python memory of every graphing phase.
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import bpy
+import addon_utils
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import sceneNodes
+
+
+
+def resetData():
+
+    for nodeGroup in list(bpy.data.node_groups):
+        bpy.data.node_groups.remove(nodeGroup)
+
+    scene = bpy.data.scenes[0]
+
+    for otherScene in list(bpy.data.scenes)[1:]:
+        bpy.data.scenes.remove(otherScene)
+
+    for object in list(scene.objects):
+        scene.objects.unlink(object)
+
+    for object in list(bpy.data.objects):
+        bpy.data.objects.remove(object)
+
+    for mesh in list(bpy.data.meshes):
+        bpy.data.meshes.remove(mesh)
+
+    for material in list(bpy.data.materials):
+        bpy.data.materials.remove(material)
+
+    return scene
+
+
+
+def newEmpty(scene, name, parent=None):
+
+    object = bpy.data.objects.new(name, None)
+    object.parent = parent
+    scene.objects.link(object)
+
+    return object
+
+
+
+### Scene generators ###
+
+def flatScene(size):
+
+    scene = resetData()
+
+    for objectIndex in range(size):
+        newEmpty(scene, "Flat"+str(objectIndex))
+
+
+
+def chainScene(size):
+
+    scene = resetData()
+
+    parent = None
+
+    for objectIndex in range(size):
+        parent = newEmpty(scene, "Chain"+str(objectIndex), parent)
+
+
+
+def wideScene(size, branching=8):
+
+    scene = resetData()
+
+    parents = [None]
+    objectCount = 0
+
+    while objectCount < size:
+
+        children = []
+
+        for parent in parents:
+
+            for childIndex in range(branching):
+
+                if objectCount == size:
+                    break
+
+                children.append(newEmpty(scene, "Wide"+str(objectCount), parent))
+                objectCount = objectCount + 1
+
+        parents = children
+
+
+
+def sharedMaterialScene(size, materialCount=10):
+
+    scene = resetData()
+
+    materials = [bpy.data.materials.new("Shared"+str(materialIndex)) for materialIndex in range(materialCount)]
+
+    for objectIndex in range(size):
+
+        mesh = bpy.data.meshes.new("Mesh"+str(objectIndex))
+
+        #Every object uses a couple of the shared materials
+        mesh.materials.append(materials[objectIndex % materialCount])
+        mesh.materials.append(materials[(objectIndex + 1) % materialCount])
+
+        object = bpy.data.objects.new("Mesh"+str(objectIndex), mesh)
+        scene.objects.link(object)
+
+
+
+def multiSceneScene(size, sceneCount=10):
+
+    resetData()
+
+    scenes = [bpy.data.scenes[0]] + [bpy.data.scenes.new("Scene"+str(sceneIndex)) for sceneIndex in range(1, sceneCount)]
+
+    for sceneIndex, scene in enumerate(scenes):
+
+        for objectIndex in range(size // sceneCount):
+            newEmpty(scene, "Scene"+str(sceneIndex)+"Object"+str(objectIndex))
+
+
+
+scenarios = [
+    ("flat", flatScene),
+    ("chain", chainScene),
+    ("wide", wideScene),
+    ("shared materials", sharedMaterialScene),
+    ("multiple scenes", multiSceneScene),
+    ]
+
+
+
+### Measurement ###
+
+def measure(function):
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    result = function()
+
+    wallTime = time.perf_counter() - start
+    peakMemory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return result, wallTime, peakMemory
+
+
+
+def graphPhases(nodeGroup):
+
+    phases = []
+
+    index, wallTime, peakMemory = measure(sceneNodes.SceneIndex.build)
+    phases.append(("index", wallTime, peakMemory))
+
+    def buildLayouts():
+        return [sceneNodes.SceneLayout(sceneNodes.SceneForest(index, scene)) for scene in index.scenes]
+
+    layouts, wallTime, peakMemory = measure(buildLayouts)
+    phases.append(("forest + layout", wallTime, peakMemory))
+
+    result, wallTime, peakMemory = measure(bpy.ops.scene_nodes.graph_scene)
+    phases.append(("graph scene", wallTime, peakMemory))
+
+    def resync():
+        sceneNodes.setGraphing(True)
+        changes = sceneNodes.syncGraph(nodeGroup)
+        sceneNodes.setGraphing(False)
+        return changes
+
+    changes, wallTime, peakMemory = measure(resync)
+    phases.append(("sync (no changes)", wallTime, peakMemory))
+
+    #Node updates only mark the tree, the links are applied once per editor event
+    result, wallTime, peakMemory = measure(lambda: sceneNodes.applyParentLinks(nodeGroup))
+    phases.append(("applyParentLinks", wallTime, peakMemory))
+
+    return phases
+
+
+
+def main():
+
+    argv = sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(description="Benchmark Scene Nodes graphing")
+    parser.add_argument("--size", type=int, default=1000, help="Objects per scenario")
+    parser.add_argument("--scenario", action="append", help="Only run the named scenarios")
+    args = parser.parse_args(argv)
+
+    addon_utils.enable("sceneNodes", default_set=True)
+
+    for name, generator in scenarios:
+
+        if args.scenario and name not in args.scenario:
+            continue
+
+        generator(args.size)
+
+        nodeGroup = bpy.data.node_groups.new("NodeTree", 'SceneTreeType')
+
+        phases = graphPhases(nodeGroup)
+
+        print(name+": "+str(len(bpy.data.objects))+" objects, "+str(len(nodeGroup.nodes))+" nodes, "+str(len(nodeGroup.links))+" links")
+
+        for phase, wallTime, peakMemory in phases:
+            print("    {:<20} {:>10.2f} ms {:>10.1f} KiB peak".format(phase, wallTime * 1000, peakMemory / 1024))
+
+
+
+main()
@@ -1,6 +1,26 @@
 import bpy
+import argparse
+import base64
+import bisect
+import fnmatch
+import gzip
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+import time
+import zlib
+from xml.sax.saxutils import quoteattr
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from bpy.types import NodeTree, Node, NodeSocket
 import nodeitems_utils
+from bpy.app.handlers import persistent
 from nodeitems_utils import NodeCategory, NodeItem
 
 
@@ -17,145 +37,3683 @@ bl_info = {
 
 
 
-bpy.types.Scene.graphing = bpy.props.BoolProperty(default=False)
-bpy.types.Scene.appended_header = bpy.props.BoolProperty(default=False)
+bpy.types.Scene.graphing = bpy.props.BoolProperty(default=False)
+bpy.types.Scene.appended_header = bpy.props.BoolProperty(default=False)
+
+bpy.types.Scene.graph_filtering = bpy.props.BoolProperty(default=False)
+bpy.types.Scene.graph_auto_sync = bpy.props.BoolProperty(default=False)
+bpy.types.Scene.graph_depth_limit = bpy.props.IntProperty(name="Depth Limit", description="Levels of children graphed before branches are collapsed, 0 graphs everything", default=0, min=0)
+
+bpy.types.WindowManager.graph_running = bpy.props.BoolProperty(default=False)
+bpy.types.WindowManager.graph_progress = bpy.props.FloatProperty(default=0, subtype="FACTOR")
+
+
+nodeTypes = ["mesh", "camera", "lamp", "armature", "curve", "lattice", "meta", "empty", "surface", "font", "speaker", "material"]
+
+for node in nodeTypes:
+    
+    setattr(bpy.types.Scene, "graph_"+node+"_objects", bpy.props.BoolProperty(default=True))
+
+bpy.types.Scene.graph_materials = bpy.props.BoolProperty(default=True)
+
+bpy.types.Scene.graph_name_filter = bpy.props.StringProperty(name="Name Filter", description="Only graph objects matching one of these comma separated wildcard patterns")
+bpy.types.Scene.graph_selected_only = bpy.props.BoolProperty(name="Selected Only", description="Only graph selected objects", default=False)
+bpy.types.Scene.graph_visible_layers_only = bpy.props.BoolProperty(name="Visible Layers Only", description="Only graph objects on the scene's visible layers", default=False)
+bpy.types.Scene.graph_group_filter = bpy.props.StringProperty(name="Group Filter", description="Only graph objects in this group")
+bpy.types.Scene.graph_parent_chain = bpy.props.BoolProperty(name="Parent Chain", description="Connect objects whose parent is filtered out to their nearest graphed ancestor, instead of the scene", default=False)
+
+
+
+def getPreferences():
+    
+    return bpy.context.user_preferences.addons['sceneNodes'].preferences
+
+
+
+def getNodeColour(nodeType):
+    
+    profiler.count("colour lookups")
+    
+    #Have to use getattr as it "doesn't support ID properties"
+    return getattr(getPreferences(), nodeType.lower()+"_node_colour")
+
+
+
+logLevels = {"ERROR": 0, "INFO": 1, "DEBUG": 2}
+
+#Kept as a number so checking it is all a disabled message costs
+logLevel = 0
+
+
+
+def log(level, *message):
+    
+    if logLevels[level] <= logLevel:
+        
+        print(*message)
+
+
+
+def updateLogLevel(preferences, context):
+    
+    global logLevel
+    
+    logLevel = logLevels[preferences.log_level]
+
+
+
+#Records how long each phase of graphing takes and counts what it does
+class GraphProfiler:
+    
+    def __init__(self, operation):
+        
+        self.operation = operation
+        self.timings = {}
+        self.phaseOrder = []
+        self.counts = {}
+        self.startTime = time.perf_counter()
+        self.totalTime = 0
+    
+    
+    def phase(self, name):
+        
+        return ProfilerPhase(self, name)
+    
+    
+    def addTime(self, name, seconds):
+        
+        if name not in self.timings:
+            
+            self.timings[name] = 0
+            self.phaseOrder.append(name)
+        
+        self.timings[name] += seconds
+    
+    
+    def count(self, name, amount=1):
+        
+        self.counts[name] = self.counts.get(name, 0) + amount
+    
+    
+    def stop(self):
+        
+        self.totalTime = time.perf_counter() - self.startTime
+    
+    
+    def summary(self):
+        
+        phases = ", ".join(name+" "+"%.1f" % (self.timings[name] * 1000)+"ms" for name in self.phaseOrder)
+        counts = ", ".join(str(self.counts[name])+" "+name for name in sorted(self.counts))
+        
+        return self.operation+" took "+"%.1f" % (self.totalTime * 1000)+"ms ("+phases+"); "+counts
+    
+    
+    def write(self, path):
+        
+        record = {
+            "operation": self.operation,
+            "time": time.time(),
+            "file": bpy.data.filepath,
+            "total_seconds": self.totalTime,
+            "phases": [{"name": name, "seconds": self.timings[name]} for name in self.phaseOrder],
+            "counts": self.counts,
+            }
+        
+        #One JSON object per line, so runs can be appended and read back one at a time
+        with open(path, "a") as logFile:
+            
+            logFile.write(json.dumps(record)+"\n")
+
+
+
+class ProfilerPhase:
+    
+    def __init__(self, profiler, name):
+        
+        self.profiler = profiler
+        self.name = name
+    
+    
+    def __enter__(self):
+        
+        self.startTime = time.perf_counter()
+    
+    
+    def __exit__(self, *exception):
+        
+        self.profiler.addTime(self.name, time.perf_counter() - self.startTime)
+
+
+
+#Stands in for the profiler when profiling is off, so graphing doesn't have to
+#check whether it's enabled
+class NullProfiler:
+    
+    def phase(self, name):
+        
+        return nullPhase
+    
+    
+    def count(self, name, amount=1):
+        
+        pass
+
+
+
+class NullPhase:
+    
+    def __enter__(self):
+        
+        pass
+    
+    
+    def __exit__(self, *exception):
+        
+        pass
+
+
+nullPhase = NullPhase()
+
+profiler = NullProfiler()
+
+
+
+def startProfiling(operation):
+    
+    global profiler
+    
+    preferences = getPreferences()
+    
+    updateLogLevel(preferences, bpy.context)
+    
+    if preferences.profile_graphing:
+        
+        profiler = GraphProfiler(operation)
+        
+    else:
+        
+        profiler = NullProfiler()
+
+
+
+#Reports the finished run through the operator and appends it to the log file
+#bpy.app.tempdir is deleted when Blender quits, so the log defaults to the
+#temporary directory from the user preferences, then to the .blend file's
+#directory, so it's still there after the session
+def getProfileLogPath():
+    
+    path = getPreferences().profile_log_path
+    
+    if path:
+        
+        return bpy.path.abspath(path)
+    
+    directory = bpy.context.user_preferences.filepaths.temporary_directory
+    
+    if directory == "" and bpy.data.filepath:
+        
+        directory = os.path.dirname(bpy.data.filepath)
+    
+    if directory == "":
+        
+        directory = tempfile.gettempdir()
+    
+    return os.path.join(bpy.path.abspath(directory), "scene_nodes_profile.jsonl")
+
+
+
+def stopProfiling(operator):
+    
+    global profiler
+    
+    if isinstance(profiler, GraphProfiler):
+        
+        profiler.stop()
+        
+        operator.report({'INFO'}, profiler.summary())
+        
+        path = getProfileLogPath()
+        
+        try:
+            
+            profiler.write(path)
+            
+        except OSError as error:
+            
+            operator.report({'WARNING'}, "Couldn't write profile to "+path+": "+str(error))
+    
+    profiler = NullProfiler()
+
+
+
+def setGraphing(state):
+    
+    #Nodes check the guard of their own scene, so every scene needs flagging,
+    #not just the active one
+    for scene in bpy.data.scenes:
+        
+        if scene.graphing != state:
+            
+            scene.graphing = state
+    
+    #Graphing can re-bind and remove nodes, so nothing drawn before is safe to reuse
+    invalidateReferences()
+
+
+
+#Sets the graphing guard for a with block, and clears it even if the block fails,
+#as a guard left on is saved with the file and quietly stops deletion and syncing
+class GraphingGuard:
+    
+    def __enter__(self):
+        
+        setGraphing(True)
+    
+    
+    def __exit__(self, *exception):
+        
+        setGraphing(False)
+
+
+
+#Datablocks and icons the nodes draw, by node pointer, so redraws don't have to
+#look anything up by name. Cleared whenever data may have been renamed, removed
+#or replaced by undo, because a stale pointer would point at freed memory
+referenceCache = {}
+
+#Bumped to invalidate every cached reference at once. Entries from an older
+#generation are resolved again the next time they're drawn
+referenceGeneration = 0
+
+#Number of scenes, objects and materials the last time the cache was checked
+dataCounts = (0, 0, 0)
+
+
+
+def invalidateReferences():
+    
+    global referenceGeneration
+    
+    referenceGeneration = referenceGeneration + 1
+
+
+
+def getCachedReference(node, resolve):
+    
+    key = node.as_pointer()
+    
+    entry = referenceCache.get(key)
+    
+    if entry is None or entry[0] != referenceGeneration:
+        
+        entry = referenceCache[key] = (referenceGeneration, resolve())
+    
+    return entry[1]
+
+
+
+def getObjectIcon(object):
+    
+    if object.type == "SPEAKER":
+        
+        return object.type
+    
+    return object.type+"_DATA"
+
+
+
+@persistent
+def invalidateReferencesHandler(*args):
+    
+    invalidateReferences()
+    referenceCache.clear()
+    statisticsCache.clear()
+    searchIndexes.clear()
+    dependencyIndexes.clear()
+    objectSignatures.clear()
+    materialNames.clear()
+
+
+
+@persistent
+def checkDependenciesHandler(scene):
+    
+    if len(dependencyIndexes) > 0 and (bpy.data.objects.is_updated or bpy.data.meshes.is_updated):
+        
+        dependencyIndexes.clear()
+
+
+
+@persistent
+def checkReferencesHandler(scene):
+    
+    global dataCounts
+    
+    counts = (len(bpy.data.scenes), len(bpy.data.objects), len(bpy.data.materials))
+    
+    #Blender flags a datablock type whenever one of its datablocks is added,
+    #removed or changed, so a removal is caught even when another datablock
+    #takes its place and the counts stay the same
+    if counts != dataCounts or bpy.data.scenes.is_updated or bpy.data.objects.is_updated or bpy.data.materials.is_updated:
+        
+        dataCounts = counts
+        invalidateReferences()
+
+
+
+objectTypes = ["mesh", "camera", "lamp", "armature", "curve", "lattice", "meta", "empty", "surface", "font", "speaker"]
+
+
+
+#Everything the scene's filter settings ask for, worked out once per graphing
+#run so checking an object doesn't need any property lookups
+class GraphFilter:
+    
+    def __init__(self, scene):
+        
+        self.scene = scene
+        
+        filtering = scene.graph_filtering
+        
+        self.materials = scene.graph_materials or not filtering
+        self.parentChain = filtering and scene.graph_parent_chain
+        
+        #None means that part of the filter is off
+        self.objectTypes = None
+        self.namePattern = None
+        self.layers = None
+        self.groupName = None
+        self.selectedOnly = False
+        
+        if not filtering:
+            
+            return
+        
+        shownTypes = set(objectType.upper() for objectType in objectTypes if getattr(scene, "graph_"+objectType+"_objects"))
+        
+        if len(shownTypes) < len(objectTypes):
+            
+            self.objectTypes = shownTypes
+        
+        patterns = [pattern.strip() for pattern in scene.graph_name_filter.split(",") if pattern.strip()]
+        
+        if len(patterns) > 0:
+            
+            self.namePattern = re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns), re.IGNORECASE)
+        
+        if scene.graph_visible_layers_only:
+            
+            self.layers = [layerIndex for layerIndex, visible in enumerate(scene.layers) if visible]
+        
+        if scene.graph_group_filter != "":
+            
+            self.groupName = scene.graph_group_filter
+        
+        self.selectedOnly = scene.graph_selected_only
+    
+    
+    #The smallest set of objects that could pass, taken from the index so a
+    #narrow filter never visits objects it leaves out
+    def getCandidates(self, index):
+        
+        sceneObjects = index.objects[self.scene.name]
+        
+        if self.groupName is not None:
+            
+            group = bpy.data.groups.get(self.groupName)
+            
+            if group is None:
+                
+                return []
+            
+            candidates = [object for object in group.objects if sceneObjects.get(object.name) == object]
+            
+        elif self.objectTypes is not None:
+            
+            objectsByType = index.objectsByType[self.scene.name]
+            
+            candidates = [object for objectType in self.objectTypes for object in objectsByType.get(objectType, [])]
+            
+        else:
+            
+            return list(sceneObjects.values())
+        
+        #Keep the scene's order, so the layout doesn't depend on how objects were found
+        positions = index.positions[self.scene.name]
+        candidates.sort(key=lambda object: positions[object.name])
+        
+        return candidates
+    
+    
+    def matches(self, object):
+        
+        if self.objectTypes is not None and object.type not in self.objectTypes:
+            
+            return False
+        
+        if self.namePattern is not None and not self.namePattern.match(object.name):
+            
+            return False
+        
+        if self.selectedOnly and not object.select:
+            
+            return False
+        
+        if self.layers is not None and not any(object.layers[layerIndex] for layerIndex in self.layers):
+            
+            return False
+        
+        return True
+    
+    
+    #Like matches, for an object that didn't come from getCandidates
+    def includes(self, object):
+        
+        if self.groupName is not None:
+            
+            group = bpy.data.groups.get(self.groupName)
+            
+            if group is None or object.name not in group.objects:
+                
+                return False
+        
+        return self.matches(object)
+    
+    
+    #The object SceneForest would make the object's parent, or None for a root
+    def getGraphedParent(self, object):
+        
+        def isGraphed(parent):
+            
+            return self.scene.objects.get(parent.name) == parent and self.includes(parent)
+        
+        parent = object.parent
+        
+        if self.parentChain:
+            
+            while parent and not isGraphed(parent):
+                
+                parent = parent.parent
+        
+        return parent if parent and isGraphed(parent) else None
+
+
+
+def childrenShownByDefault(scene, depth):
+    
+    return scene.graph_depth_limit == 0 or depth + 1 < scene.graph_depth_limit
+
+
+
+def hasMaterialSocket(object):
+    
+    return object.type == "MESH" or len(object.material_slots) > 0
+
+
+
+#Walks bpy.data once and keeps maps of everything graphing needs, so nothing
+#has to search the scene again while nodes are being built
+class SceneIndex:
+    
+    def __init__(self, dependencies=False):
+        
+        self.scenes = []
+        #Scene name -> {object name: object}
+        self.objects = {}
+        #Scene name -> {object name: position in scene.objects}
+        self.positions = {}
+        #Scene name -> {object type: objects}
+        self.objectsByType = {}
+        #Scene name -> objects without a parent
+        self.roots = {}
+        #(scene name, parent name) -> child objects
+        self.children = {}
+        #Object name -> materials in slot order, without duplicates. Only filled
+        #in for graphed objects, as going through material slots is slow
+        self.objectMaterials = {}
+        #Material name -> graphed objects using it
+        self.materialUsers = {}
+        self.materials = {}
+        #Only gathered when asked for, as it means looking through every modifier,
+        #constraint and driver
+        self.dependencies = dependencies
+        #Object name -> [(object depending on it, relation)]
+        self.dependents = {}
+        #Object data -> objects sharing it
+        self.dataUsers = {}
+        self.dependencyObjects = set()
+    
+    
+    @classmethod
+    def build(cls, scenes=None, dependencies=False):
+        
+        index = cls(dependencies)
+        
+        if scenes is None:
+            
+            scenes = bpy.data.scenes
+        
+        for scene in scenes:
+            
+            index.addScene(scene)
+        
+        return index
+    
+    
+    def addScene(self, scene):
+        
+        self.scenes.append(scene)
+        
+        sceneObjects = self.objects[scene.name] = {}
+        positions = self.positions[scene.name] = {}
+        objectsByType = self.objectsByType[scene.name] = {}
+        roots = self.roots[scene.name] = []
+        
+        for object in scene.objects:
+            
+            positions[object.name] = len(sceneObjects)
+            sceneObjects[object.name] = object
+            objectsByType.setdefault(object.type, []).append(object)
+            
+            if object.parent == None:
+                
+                roots.append(object)
+                
+            else:
+                
+                self.children.setdefault((scene.name, object.parent.name), []).append(object)
+            
+            #Objects can be linked to several scenes, but only need indexing once
+            if self.dependencies and object.name not in self.dependencyObjects:
+                
+                self.dependencyObjects.add(object.name)
+                self.addObjectDependencies(object)
+    
+    
+    def getObjectMaterials(self, object):
+        
+        materials = self.objectMaterials.get(object.name)
+        
+        if materials is None:
+            
+            materials = self.addObjectMaterials(object)
+        
+        return materials
+    
+    
+    def addObjectMaterials(self, object):
+        
+        materials = self.objectMaterials[object.name] = []
+        
+        for materialSlot in object.material_slots:
+            
+            material = materialSlot.material
+            
+            if material and material not in materials:
+                
+                materials.append(material)
+                self.materials[material.name] = material
+                self.materialUsers.setdefault(material.name, []).append(object)
+        
+        return materials
+    
+    
+    def addObjectDependencies(self, object):
+        
+        targets = []
+        
+        for modifier in object.modifiers:
+            
+            targets.extend((target, 'MODIFIER') for target in getObjectPointers(modifier))
+        
+        for constraint in object.constraints:
+            
+            targets.extend((target, 'CONSTRAINT') for target in getObjectPointers(constraint))
+        
+        #Drivers on shape keys and other object data count as the object's own
+        for animated in (object, object.data):
+            
+            animationData = getattr(animated, "animation_data", None)
+            
+            if animationData is None:
+                
+                continue
+            
+            for fcurve in animationData.drivers:
+                
+                for variable in fcurve.driver.variables:
+                    
+                    targets.extend((target.id, 'DRIVER') for target in variable.targets if target.id_type == 'OBJECT' and target.id)
+        
+        added = set()
+        
+        for target, relation in targets:
+            
+            if target != object and (target.name, relation) not in added:
+                
+                added.add((target.name, relation))
+                self.dependents.setdefault(target.name, []).append((object, relation))
+        
+        if object.data and object.data.users > 1:
+            
+            self.dataUsers.setdefault(object.data, []).append(object)
+    
+    
+    def getChildren(self, scene, object):
+        
+        return self.children.get((scene.name, object.name), [])
+    
+    
+    def getDependents(self, object):
+        
+        dependents = list(self.dependents.get(object.name, []))
+        
+        if object.data:
+            
+            dependents.extend((user, 'DATA') for user in self.dataUsers.get(object.data, []) if user != object)
+        
+        return dependents
+
+
+
+#Modifier or constraint type -> names of its properties pointing at objects
+objectPointerNames = {}
+
+
+
+def getObjectPointers(struct):
+    
+    structType = struct.bl_rna.identifier
+    
+    if structType not in objectPointerNames:
+        
+        objectPointerNames[structType] = [prop.identifier for prop in struct.bl_rna.properties if prop.type == 'POINTER' and prop.fixed_type.identifier == 'Object']
+    
+    return [getattr(struct, name) for name in objectPointerNames[structType] if getattr(struct, name)]
+
+
+
+NODE_WIDTH = 140
+ROW_HEIGHT = 140
+
+
+
+#The parent/child hierarchy of the graphed objects in one scene. Children of
+#objects that are filtered out become roots, or with the parent chain filter,
+#children of their nearest graphed ancestor
+class SceneForest:
+    
+    def __init__(self, index, scene, graphFilter=None):
+        
+        if graphFilter is None:
+            
+            graphFilter = GraphFilter(scene)
+        
+        self.scene = scene
+        self.graphFilter = graphFilter
+        self.roots = []
+        self.children = {}
+        #Object name -> graphed parent object, or None for roots
+        self.parents = {}
+        
+        graphedObjects = [object for object in graphFilter.getCandidates(index) if graphFilter.matches(object)]
+        graphedNames = set(object.name for object in graphedObjects)
+        
+        #Materials are indexed for every graphed object up front, so user counts
+        #are complete before the first material node is made
+        if graphFilter.materials:
+            
+            for object in graphedObjects:
+                
+                index.getObjectMaterials(object)
+        
+        for object in graphedObjects:
+            
+            parent = object.parent
+            
+            if graphFilter.parentChain:
+                
+                while parent and parent.name not in graphedNames:
+                    
+                    parent = parent.parent
+            
+            if parent and parent.name in graphedNames:
+                
+                self.parents[object.name] = parent
+                self.children.setdefault(parent.name, []).append(object)
+                
+            else:
+                
+                self.parents[object.name] = None
+                self.roots.append(object)
+    
+    
+    #showChildren(object, depth) decides whether an object's children are
+    #included, so collapsed branches are never visited
+    def getChildren(self, object, depth, showChildren=None):
+        
+        if showChildren and not showChildren(object, depth):
+            
+            return []
+        
+        return self.children.get(object.name, [])
+    
+    
+    #Yields (object, depth) with every parent before its children. Iterative, so
+    #deep chains don't hit the recursion limit
+    def walk(self, showChildren=None, roots=None):
+        
+        if roots is None:
+            
+            roots = self.roots
+        
+        stack = [(root, 0) for root in reversed(roots)]
+        
+        while stack:
+            
+            object, depth = stack.pop()
+            
+            yield object, depth
+            
+            stack.extend((child, depth+1) for child in reversed(self.getChildren(object, depth, showChildren)))
+
+
+
+    #Yields (object, depth, shown children) with every object after its children
+    def walkChildrenFirst(self, showChildren=None, roots=None):
+        
+        if roots is None:
+            
+            roots = self.roots
+        
+        stack = [(root, 0, False) for root in reversed(roots)]
+        
+        while stack:
+            
+            object, depth, childrenDone = stack.pop()
+            
+            children = self.getChildren(object, depth, showChildren)
+            
+            if childrenDone or len(children) == 0:
+                
+                yield object, depth, children
+                
+            else:
+                
+                stack.append((object, depth, True))
+                stack.extend((child, depth+1, False) for child in reversed(children))
+
+
+
+#Works out every node location of a scene in one pass over its forest, before
+#any nodes exist. Each leaf gets its own row and parents are centred on their
+#children, so subtrees never overlap
+class SceneLayout:
+    
+    def __init__(self, forest, firstRow=0, showChildren=None, roots=None):
+        
+        if roots is None:
+            
+            roots = forest.roots
+        
+        #Object name -> (x, y)
+        self.locations = {}
+        
+        rootX = NODE_WIDTH + 80
+        columnWidth = NODE_WIDTH + 120
+        
+        row = firstRow
+        
+        for object, depth, children in forest.walkChildrenFirst(showChildren, roots):
+            
+            if len(children) > 0:
+                
+                firstY = self.locations[children[0].name][1]
+                lastY = self.locations[children[-1].name][1]
+                
+                self.locations[object.name] = (rootX + depth * columnWidth, (firstY + lastY) / 2)
+                
+            else:
+                
+                self.locations[object.name] = (rootX + depth * columnWidth, row * -ROW_HEIGHT)
+                row = row + 1
+        
+        
+        if len(roots) > 0:
+            
+            firstY = self.locations[roots[0].name][1]
+            lastY = self.locations[roots[-1].name][1]
+            
+            self.sceneLocation = (0, (firstY + lastY) / 2)
+            
+        else:
+            
+            self.sceneLocation = (0, row * -ROW_HEIGHT)
+            row = row + 1
+        
+        #Rows taken up by this scene, so the next scene can start below it
+        self.lastRow = row
+
+
+
+#Node locations from earlier runs, stored on the node tree so they're saved with
+#the file. Objects are stored as an offset from their parent's node, along with
+#a hash of their subtree, so unchanged subtrees keep their arrangement, including
+#any the user made, while changed ones are laid out again
+class LayoutCache:
+    
+    propertyName = "scene_nodes_layout"
+    
+    
+    def __init__(self, nodeGroup, useStored=True):
+        
+        stored = nodeGroup.get(self.propertyName)
+        
+        if stored and useStored and isinstance(stored, str):
+            
+            stored = json.loads(zlib.decompress(base64.b64decode(stored)).decode("utf-8"))
+            
+        else:
+            
+            stored = {}
+        
+        #Scene name -> [x, y]
+        self.scenes = stored.get("scenes", {})
+        #Scene name -> {object name: [subtree hash, x offset, y offset]}
+        self.objects = stored.get("objects", {})
+        #Material name -> [x, y]
+        self.materials = stored.get("materials", {})
+        
+        self.newScenes = {}
+        self.newObjects = {}
+        self.newMaterials = {}
+    
+    
+    #Picks up where the user has moved nodes since the cache was saved
+    def remember(self, nodeGroup):
+        
+        parentNodes = dict((link.to_node.as_pointer(), link.from_node) for link in nodeGroup.links if link.to_node.bl_idname == 'ObjectNodeType')
+        
+        for node in nodeGroup.nodes:
+            
+            if node.bl_idname == 'SceneNodeType':
+                
+                self.scenes[node.sceneIndex] = [int(node.location[0]), int(node.location[1])]
+                
+            elif node.bl_idname == 'MaterialNodeType':
+                
+                self.materials[node.materialIndex] = [int(node.location[0]), int(node.location[1])]
+                
+            elif node.bl_idname == 'ObjectNodeType':
+                
+                entry = self.objects.get(node.scene, {}).get(node.objectIndex)
+                parentNode = parentNodes.get(node.as_pointer())
+                
+                #Without a hash from an earlier run there's nothing to match against
+                if entry and parentNode:
+                    
+                    entry[1] = int(node.location[0] - parentNode.location[0])
+                    entry[2] = int(node.location[1] - parentNode.location[1])
+    
+    
+    #Works out the scene's final locations from a fresh layout, keeping the cached
+    #arrangement of every subtree whose hash hasn't changed
+    def placeScene(self, scene, forest, layout, hashes, showChildren):
+        
+        sceneLocation = self.scenes.get(scene.name, layout.sceneLocation)
+        self.newScenes[scene.name] = [int(sceneLocation[0]), int(sceneLocation[1])]
+        
+        cachedObjects = self.objects.get(scene.name, {})
+        newObjects = self.newObjects[scene.name] = {}
+        
+        locations = {}
+        
+        for object, depth in forest.walk(showChildren):
+            
+            parent = forest.parents[object.name]
+            
+            if parent:
+                
+                parentLocation = locations[parent.name]
+                freshParentLocation = layout.locations[parent.name]
+                
+            else:
+                
+                parentLocation = sceneLocation
+                freshParentLocation = layout.sceneLocation
+            
+            entry = cachedObjects.get(object.name)
+            
+            if entry and entry[0] == hashes[object.name]:
+                
+                offset = (entry[1], entry[2])
+                
+            else:
+                
+                freshLocation = layout.locations[object.name]
+                offset = (int(freshLocation[0] - freshParentLocation[0]), int(freshLocation[1] - freshParentLocation[1]))
+            
+            locations[object.name] = (parentLocation[0] + offset[0], parentLocation[1] + offset[1])
+            newObjects[object.name] = [hashes[object.name], offset[0], offset[1]]
+        
+        return sceneLocation, locations
+    
+    
+    def placeMaterial(self, materialNode):
+        
+        if materialNode.materialIndex in self.materials:
+            
+            materialNode.location = self.materials[materialNode.materialIndex]
+        
+        self.newMaterials[materialNode.materialIndex] = [int(materialNode.location[0]), int(materialNode.location[1])]
+    
+    
+    #Only what was graphed this time is kept, so the cache can't grow forever.
+    #It's packed into one compressed string, as an ID property group with an
+    #entry per object is slow to write and weighs down every undo step and file
+    def save(self, nodeGroup):
+        
+        data = json.dumps({"scenes": self.newScenes, "objects": self.newObjects, "materials": self.newMaterials}, separators=(",", ":"))
+        
+        nodeGroup[self.propertyName] = base64.b64encode(zlib.compress(data.encode("utf-8"))).decode("ascii")
+
+
+
+#A hash of each object's subtree: its name, materials and children. Stable
+#between sessions, unlike hash()
+def getSubtreeHashes(forest, index, showChildren):
+    
+    hashes = {}
+    
+    for object, depth, children in forest.walkChildrenFirst(showChildren):
+        
+        parts = [object.name]
+        
+        #Material nodes only move a subtree's layout where the scene graphs them
+        if forest.graphFilter.materials:
+            
+            parts.extend(material.name for material in index.getObjectMaterials(object))
+        
+        parts.extend(str(hashes[child.name]) for child in children)
+        
+        #Kept to 31 bits so it fits an integer ID property
+        hashes[object.name] = zlib.crc32("\0".join(parts).encode("utf-8")) & 0x7fffffff
+    
+    return hashes
+
+
+
+### Search ###
+
+#Search indexes by tree name. Rebuilt whenever the tree is graphed or synced
+searchIndexes = {}
+
+SEARCH_ICONS = {'SCENE': "SCENE_DATA", 'OBJECT': "OBJECT_DATA", 'MATERIAL': "MATERIAL_DATA"}
+
+
+
+#Names of everything a tree graphs, searchable by prefix through a sorted list
+#and by substring through the three letter runs in each name
+class NodeSearchIndex:
+    
+    def __init__(self, index, forests):
+        
+        #(lower case name, label, node key)
+        self.entries = []
+        #Node key -> name of the node last made for it
+        self.nodeNames = {}
+        
+        graphMaterials = False
+        
+        for forest in forests:
+            
+            scene = forest.scene
+            self.addEntry(scene.name, scene.name, ('SCENE', scene.name))
+            
+            for objectName in forest.parents:
+                
+                self.addEntry(objectName, objectName+" ("+scene.name+")", ('OBJECT', scene.name, objectName))
+            
+            graphMaterials = graphMaterials or forest.graphFilter.materials
+        
+        if graphMaterials:
+            
+            for materialName in index.materials:
+                
+                self.addEntry(materialName, materialName, ('MATERIAL', materialName))
+        
+        self.prefixes = sorted((entry[0], entryIndex) for entryIndex, entry in enumerate(self.entries))
+        
+        #Made on first use, so graphing and syncing don't pay for searches that never happen
+        self.trigrams = None
+        self.items = None
+    
+    
+    def addEntry(self, name, label, key):
+        
+        self.entries.append((name.lower(), label, key))
+    
+    
+    def getTrigrams(self):
+        
+        if self.trigrams is None:
+            
+            self.trigrams = {}
+            
+            for entryIndex, entry in enumerate(self.entries):
+                
+                name = entry[0]
+                
+                for start in range(len(name) - 2):
+                    
+                    self.trigrams.setdefault(name[start:start+3], set()).add(entryIndex)
+        
+        return self.trigrams
+    
+    
+    #Enum items for the search popup. Blender needs them kept alive, and making
+    #them once per graph keeps the popup quick to open
+    def getItems(self):
+        
+        if self.items is None:
+            
+            self.items = [(str(entryIndex), label, "", SEARCH_ICONS[key[0]], entryIndex) for entryIndex, (name, label, key) in enumerate(self.entries)]
+        
+        return self.items
+    
+    
+    def noteNodes(self, nodes):
+        
+        for node in nodes:
+            
+            key = getNodeKey(node)
+            
+            if key:
+                
+                self.nodeNames[key] = node.name
+    
+    
+    #Entry indexes whose names contain the query, names starting with it first
+    def search(self, query, limit=50):
+        
+        query = query.lower()
+        results = []
+        
+        start = bisect.bisect_left(self.prefixes, (query, -1))
+        
+        for name, entryIndex in self.prefixes[start:]:
+            
+            if len(results) == limit or not name.startswith(query):
+                
+                break
+            
+            results.append(entryIndex)
+        
+        #Shorter queries only match prefixes, as nearly every name would contain them
+        if len(query) < 3 or len(results) == limit:
+            
+            return results
+        
+        trigrams = self.getTrigrams()
+        candidates = None
+        
+        for start in range(len(query) - 2):
+            
+            entryIndexes = trigrams.get(query[start:start+3], set())
+            candidates = entryIndexes if candidates is None else candidates & entryIndexes
+            
+            if len(candidates) == 0:
+                
+                return results
+        
+        prefixMatches = set(results)
+        
+        for entryIndex in sorted(candidates):
+            
+            if len(results) == limit:
+                
+                break
+            
+            if entryIndex not in prefixMatches and query in self.entries[entryIndex][0]:
+                
+                results.append(entryIndex)
+        
+        return results
+    
+    
+    #The node for a key, without looking through the whole tree
+    def findNode(self, nodeGroup, key):
+        
+        node = nodeGroup.nodes.get(self.nodeNames.get(key, ""))
+        
+        if node and getNodeKey(node) == key:
+            
+            return node
+        
+        return None
+
+
+
+def getSearchIndex(nodeGroup):
+    
+    searchIndex = searchIndexes.get(nodeGroup.name)
+    
+    #Trees loaded from a file haven't been graphed in this session yet
+    if searchIndex is None:
+        
+        index = SceneIndex.build(getTreeScenes(nodeGroup))
+        
+        searchIndex = updateSearchIndex(nodeGroup, index, [SceneForest(index, scene) for scene in index.scenes], nodeGroup.nodes)
+    
+    return searchIndex
+
+
+
+def updateSearchIndex(nodeGroup, index, forests, nodes):
+    
+    searchIndex = searchIndexes[nodeGroup.name] = NodeSearchIndex(index, forests)
+    searchIndex.noteNodes(nodes)
+    
+    return searchIndex
+
+
+
+### Statistics ###
+
+#Approximate bytes Blender stores per vertex, edge, face and face corner
+MESH_ELEMENT_BYTES = (20, 12, 12, 8)
+
+#Statistics by datablock, so graphing again doesn't gather them again. Entries
+#are (signature, statistics), and are gathered again when the datablock's
+#signature no longer matches. Checking when they're used keeps the cost off
+#every scene update
+statisticsCache = {}
+
+
+
+def getCachedStatistics(key, signature, gather):
+    
+    entry = statisticsCache.get(key)
+    
+    if entry is None or entry[0] != signature:
+        
+        entry = statisticsCache[key] = (signature, gather())
+    
+    return entry[1]
+
+
+
+def getMeshSignature(mesh):
+    
+    return (len(mesh.vertices), len(mesh.edges), len(mesh.polygons), len(mesh.loops))
+
+
+
+#Settings of every modifier, since any of them can change what it produces.
+#Objects the modifiers point at only count by name
+def getModifierSignature(object):
+    
+    signature = []
+    
+    for modifier in object.modifiers:
+        
+        for property in modifier.bl_rna.properties:
+            
+            if property.type == 'COLLECTION' or property.identifier == "rna_type":
+                
+                continue
+            
+            value = getattr(modifier, property.identifier)
+            
+            if property.type == 'POINTER':
+                
+                value = getattr(value, "name", None)
+                
+            elif isinstance(value, set):
+                
+                value = frozenset(value)
+                
+            elif getattr(property, "array_length", 0) > 0:
+                
+                value = tuple(value)
+            
+            signature.append(value)
+    
+    return tuple(signature)
+
+
+
+class MeshStatistics:
+    
+    def __init__(self, mesh):
+        
+        self.vertices = len(mesh.vertices)
+        self.faces = len(mesh.polygons)
+        
+        cornerCount = len(mesh.loops)
+        
+        #Every face with n corners makes n - 2 triangles
+        self.triangles = cornerCount - 2 * self.faces
+        
+        counts = (self.vertices, len(mesh.edges), self.faces, cornerCount)
+        
+        self.memory = sum(count * size for count, size in zip(counts, MESH_ELEMENT_BYTES))
+
+
+
+class ObjectStatistics:
+    
+    def __init__(self, object, scene):
+        
+        self.modifiers = len(object.modifiers)
+        self.vertices = 0
+        self.faces = 0
+        self.triangles = 0
+        self.memory = 0
+        
+        if object.type != "MESH":
+            
+            return
+        
+        if self.modifiers > 0:
+            
+            #Modifiers change the geometry, so measure what they produce
+            evaluatedMesh = object.to_mesh(scene, True, 'PREVIEW')
+            meshStatistics = MeshStatistics(evaluatedMesh)
+            bpy.data.meshes.remove(evaluatedMesh)
+            
+        else:
+            
+            meshStatistics = getMeshStatistics(object.data)
+        
+        self.vertices = meshStatistics.vertices
+        self.faces = meshStatistics.faces
+        self.triangles = meshStatistics.triangles
+        self.memory = meshStatistics.memory
+
+
+
+def getMeshStatistics(mesh):
+    
+    return getCachedStatistics(('MESH', mesh.name), getMeshSignature(mesh), lambda: MeshStatistics(mesh))
+
+
+
+def getObjectStatistics(object, scene):
+    
+    signature = (object.type, getattr(object.data, "name", None))
+    
+    if object.type == "MESH":
+        
+        signature = signature + (getMeshSignature(object.data), getModifierSignature(object))
+    
+    return getCachedStatistics(('OBJECT', scene.name, object.name), signature, lambda: ObjectStatistics(object, scene))
+
+
+
+def getImageMemory(image):
+    
+    #Reading the size can load the image, so the signature only uses settings
+    signature = (image.source, image.filepath_raw, image.generated_width, image.generated_height, image.is_dirty)
+    
+    return getCachedStatistics(('IMAGE', image.name), signature, lambda: measureImageMemory(image))
+
+
+
+def measureImageMemory(image):
+    
+    width, height = image.size
+    
+    return width * height * image.channels * (4 if image.is_float else 1)
+
+
+
+#Memory of every image the material's textures and nodes use
+def getMaterialTextureMemory(material):
+    
+    images = set()
+    
+    for textureSlot in material.texture_slots:
+        
+        if textureSlot and textureSlot.texture and textureSlot.texture.type == 'IMAGE' and textureSlot.texture.image:
+            
+            images.add(textureSlot.texture.image)
+    
+    if material.use_nodes and material.node_tree:
+        
+        for node in material.node_tree.nodes:
+            
+            if getattr(node, "image", None):
+                
+                images.add(node.image)
+    
+    return sum(getImageMemory(image) for image in images)
+
+
+
+def setObjectStatistics(objectNode, object, scene):
+    
+    statistics = getObjectStatistics(object, scene)
+    
+    objectNode.vertexCount = statistics.vertices
+    objectNode.faceCount = statistics.faces
+    objectNode.triangleCount = statistics.triangles
+    objectNode.modifierCount = statistics.modifiers
+    objectNode.memoryKiB = statistics.memory // 1024
+
+
+
+def setMaterialStatistics(materialNode, material):
+    
+    materialNode.textureMemoryKiB = getMaterialTextureMemory(material) // 1024
+
+
+
+def formatMemory(kibibytes):
+    
+    if kibibytes >= 1024:
+        
+        return "%.1f MiB" % (kibibytes / 1024)
+    
+    return str(kibibytes)+" KiB"
+
+
+
+#Colours nodes from cold to hot by the heatmap's value. Values are spread on a
+#log scale, since a few heavy objects would otherwise leave everything else cold
+def applyHeatmap(nodes, values):
+    
+    if len(nodes) == 0:
+        
+        return
+    
+    if numpy is not None:
+        
+        heat = numpy.log1p(numpy.array(values, dtype=numpy.float64))
+        
+        if heat.max() > 0:
+            
+            heat = heat / heat.max()
+        
+        colours = numpy.empty((len(nodes), 3))
+        colours[:, 0] = numpy.clip(heat * 2, 0, 1)
+        colours[:, 1] = 1 - numpy.abs(heat * 2 - 1) * 0.8
+        colours[:, 2] = numpy.clip(2 - heat * 2, 0, 1)
+        
+        colours = colours.tolist()
+        
+    else:
+        
+        heat = [math.log1p(value) for value in values]
+        hottest = max(heat) or 1
+        
+        colours = [(min(value / hottest * 2, 1), 1 - abs(value / hottest * 2 - 1) * 0.8, min(2 - value / hottest * 2, 1)) for value in heat]
+    
+    for node, colour in zip(nodes, colours):
+        
+        node.use_custom_color = True
+        node.color = colour
+
+
+
+#Nodes made outside a full graph gather their statistics here. The heatmap is
+#worked out again over the whole tree, so they're coloured on the same scale
+def updateStatistics(nodeGroup, nodes):
+    
+    if not nodeGroup.show_statistics or len(nodes) == 0:
+        
+        return
+    
+    for node in nodes:
+        
+        if node.bl_idname == 'ObjectNodeType':
+            
+            object = node.resolveObject()[0]
+            
+            if object:
+                
+                setObjectStatistics(node, object, bpy.data.scenes[node.scene])
+            
+        elif node.bl_idname == 'MaterialNodeType':
+            
+            material = node.resolveMaterial()[0]
+            
+            if material:
+                
+                setMaterialStatistics(node, material)
+    
+    if nodeGroup.colour_mode != 'TYPE':
+        
+        heatmapNodes = [node for node in nodeGroup.nodes if node.bl_idname in ('ObjectNodeType', 'MaterialNodeType')]
+        
+        applyHeatmap(heatmapNodes, [getHeatmapValue(node, nodeGroup.colour_mode) for node in heatmapNodes])
+
+
+
+def getHeatmapValue(node, colourMode):
+    
+    if node.bl_idname == 'MaterialNodeType':
+        
+        return node.textureMemoryKiB if colourMode == 'MEMORY' else 0
+    
+    if colourMode == 'TRIANGLES':
+        
+        return node.triangleCount
+    
+    return node.memoryKiB
+
+
+
+#Identifies which datablock a node represents, independent of the node's name
+def getNodeKey(node):
+    
+    if node.bl_idname == 'SceneNodeType':
+        
+        return ('SCENE', node.sceneIndex)
+    
+    elif node.bl_idname == 'ObjectNodeType':
+        
+        return ('OBJECT', node.scene, node.objectIndex)
+    
+    elif node.bl_idname == 'MaterialNodeType':
+        
+        return ('MATERIAL', node.materialIndex)
+    
+    return None
+
+
+
+#Keeps the nodes of the previous graph so a rebuild can bind them to the
+#current data again, instead of freeing and allocating every node
+class NodePool:
+    
+    def __init__(self, nodeGroup):
+        
+        self.nodeGroup = nodeGroup
+        self.nodes = {}
+        #Nodes that don't represent anything any more, by node type
+        self.spareNodes = {}
+        #Node key -> node made or reused for it by this run
+        self.boundNodes = {}
+        
+        for node in nodeGroup.nodes:
+            
+            key = getNodeKey(node)
+            
+            if key is None or key in self.nodes:
+                
+                self.spareNodes.setdefault(node.bl_idname, []).append(node)
+                
+            else:
+                
+                self.nodes[key] = node
+    
+    
+    #Nodes for datablocks that won't be graphed again, such as deleted or
+    #renamed ones, become spares that new datablocks can reuse
+    def keepOnly(self, wantedKeys):
+        
+        for key in [key for key in self.nodes if key not in wantedKeys]:
+            
+            node = self.nodes.pop(key)
+            self.spareNodes.setdefault(node.bl_idname, []).append(node)
+    
+    
+    #Returns the node that represented the datablock last time, or a spare one
+    #of the same type. None means a new node is needed
+    def take(self, nodeType, key):
+        
+        node = self.nodes.pop(key, None)
+        
+        if node is None and self.spareNodes.get(nodeType):
+            
+            node = self.spareNodes[nodeType].pop()
+        
+        return node
+    
+    
+    #Removes every node that wasn't reused
+    def release(self):
+        
+        for node in list(self.nodes.values()):
+            
+            self.nodeGroup.nodes.remove(node)
+        
+        for spareNodes in self.spareNodes.values():
+            
+            for node in spareNodes:
+                
+                self.nodeGroup.nodes.remove(node)
+        
+        self.nodes = {}
+        self.spareNodes = {}
+
+
+
+#Keys of every node a full graph could make. Objects in folded branches are
+#included, which only means their old nodes aren't offered as spares
+def getWantedKeys(index, forests):
+    
+    wantedKeys = set()
+    
+    for forest in forests:
+        
+        scene = forest.scene
+        wantedKeys.add(('SCENE', scene.name))
+        wantedKeys.update(('OBJECT', scene.name, objectName) for objectName in forest.parents)
+    
+    wantedKeys.update(('MATERIAL', materialName) for materialName in index.materials)
+    
+    return wantedKeys
+
+
+
+def getPooledNode(nodeGroup, nodeType, key, pool):
+    
+    node = None
+    
+    if pool:
+        
+        node = pool.take(nodeType, key)
+    
+    if node is None:
+        
+        node = nodeGroup.nodes.new(nodeType)
+        profiler.count("nodes created")
+        
+    else:
+        
+        profiler.count("nodes reused")
+    
+    if pool:
+        
+        pool.boundNodes[key] = node
+    
+    return node
+
+
+
+def setNodeName(node, name):
+    
+    #Renaming makes Blender check the name against every other node, so skip it
+    #when a reused node already has the right name
+    if node.name != name:
+        
+        node.name = name
+
+
+
+def newSceneNode(nodeGroup, scene, pool=None):
+    
+    sceneNode = getPooledNode(nodeGroup, 'SceneNodeType', ('SCENE', scene.name), pool)
+    sceneNode.sceneIndex = scene.name
+    sceneNode.select = False
+    setNodeName(sceneNode, scene.name)
+    
+    return sceneNode
+
+
+
+def newObjectNode(nodeGroup, scene, object, pool=None):
+    
+    objectNode = getPooledNode(nodeGroup, 'ObjectNodeType', ('OBJECT', scene.name, object.name), pool)
+    objectNode.objectIndex = object.name
+    objectNode.scene = scene.name
+    objectNode.select = False
+    setNodeName(objectNode, object.name)
+    objectNode.use_custom_color = True
+    objectNode.color = getNodeColour(object.type)
+    objectNode.childrenShown = True
+    objectNode.hiddenChildren = 0
+    
+    materialSocket = getMaterialSocket(objectNode)
+    
+    if hasMaterialSocket(object):
+        
+        if materialSocket is None:
+            
+            objectNode.outputs.new('NodeSocketFloat', "Material")
+        
+    elif materialSocket:
+        
+        objectNode.outputs.remove(materialSocket)
+    
+    return objectNode
+
+
+
+def newMaterialNode(nodeGroup, material, pool=None):
+    
+    materialNode = getPooledNode(nodeGroup, 'MaterialNodeType', ('MATERIAL', material.name), pool)
+    
+    #A spare node from another material mustn't carry over what was shown for it
+    if materialNode.materialIndex != material.name:
+        
+        materialNode.linksShown = False
+        materialNode.textureMemoryKiB = 0
+    
+    materialNode.materialIndex = material.name
+    materialNode.select = False
+    setNodeName(materialNode, material.name)
+    materialNode.use_custom_color = True
+    materialNode.color = getNodeColour("material")
+    
+    return materialNode
+
+
+
+#Links an object node to its parent's node and remembers which object that is,
+#so the update handler can tell the links it made from ones the user changed
+def linkParent(nodeGroup, objectNode, parentNode):
+    
+    nodeGroup.links.new(objectNode.inputs[0], parentNode.outputs[0])
+    
+    parentName = getLinkedParentName(parentNode)
+    
+    if objectNode.linkedParent != parentName:
+        
+        objectNode.linkedParent = parentName
+
+
+
+#Scene nodes stand for having no parent
+def getLinkedParentName(parentNode):
+    
+    if parentNode.bl_idname == 'ObjectNodeType':
+        
+        return parentNode.objectIndex
+    
+    return ""
+
+
+
+#Material nodes start off next to the first object that uses them
+def placeMaterialNode(materialNode, objectNode):
+    
+    materialNode.location[1] = objectNode.location[1]
+    materialNode.location[0] = objectNode.location[0] + objectNode.width + 120
+
+
+
+#Links an object node to its materials, creating material nodes that don't
+#exist yet. materialNodes maps material names to the nodes already in the tree
+def linkMaterials(nodeGroup, objectNode, materials, materialNodes, materialUsers, bundleThreshold, pool=None):
+    
+    for material in materials:
+        
+        if material.name not in materialNodes:
+            
+            materialNodes[material.name] = newMaterialNode(nodeGroup, material, pool)
+            placeMaterialNode(materialNodes[material.name], objectNode)
+            setMaterialUsers(materialNodes[material.name], len(materialUsers[material.name]), bundleThreshold)
+        
+        if materialShowsLinks(materialNodes[material.name]):
+            
+            log("DEBUG", objectNode.name)
+            nodeGroup.links.new(materialNodes[material.name].inputs[0], getMaterialSocket(objectNode))
+            profiler.count("links")
+
+
+
+#Sockets can't take more links than this
+MAX_MATERIAL_LINKS = 4095
+
+
+
+#Dependency edge types, with the socket type that gives each its own colour
+dependencyTypes = [
+    ("MODIFIER", "Modifiers", "Objects used by modifiers, like boolean cutters or array offsets", 'NodeSocketVector'),
+    ("CONSTRAINT", "Constraints", "Constraint targets", 'NodeSocketColor'),
+    ("DRIVER", "Drivers", "Objects read by drivers", 'NodeSocketShader'),
+    ("DATA", "Shared Data", "Objects sharing a mesh or other object data", 'NodeSocketInt'),
+    ]
+
+dependencySockets = dict((relation, (label, socketType)) for relation, label, description, socketType in dependencyTypes)
+dependencyRelations = dict((label, relation) for relation, (label, socketType) in dependencySockets.items())
+dependencyLabels = set(dependencyRelations)
+
+#Scene indexes with dependencies by tree name, for dependency queries. Cleared
+#when objects or meshes change
+dependencyIndexes = {}
+
+
+
+def getMaterialSocket(objectNode):
+    
+    return objectNode.outputs.get("Material")
+
+
+
+def getDependencySocket(sockets, relation):
+    
+    label, socketType = dependencySockets[relation]
+    socket = sockets.get(label)
+    
+    if socket is None:
+        
+        socket = sockets.new(socketType, label)
+        socket.link_limit = MAX_MATERIAL_LINKS
+    
+    return socket
+
+
+
+#Links every object to the objects depending on it, within each scene. Like
+#parent and material links, only links that changed are touched
+def linkDependencies(nodeGroup, index, nodesByKey):
+    
+    relations = nodeGroup.dependency_edges
+    
+    #(target key, dependent key, relation) of every link that should exist
+    wantedLinks = set()
+    
+    if len(relations) > 0:
+        
+        dependencyIndexes[nodeGroup.name] = index
+    
+    for scene in index.scenes:
+        
+        def getObjectKey(object):
+            
+            objectKey = ('OBJECT', scene.name, object.name)
+            
+            return objectKey if objectKey in nodesByKey else None
+        
+        for objectName, dependents in index.dependents.items():
+            
+            targetKey = ('OBJECT', scene.name, objectName)
+            
+            if targetKey not in nodesByKey:
+                
+                continue
+            
+            for dependent, relation in dependents:
+                
+                dependentKey = getObjectKey(dependent)
+                
+                if relation in relations and dependentKey:
+                    
+                    wantedLinks.add((targetKey, dependentKey, relation))
+        
+        #Shared data links the first user to the others, rather than every user to every other
+        if 'DATA' in relations:
+            
+            for users in index.dataUsers.values():
+                
+                userKeys = [userKey for userKey in map(getObjectKey, users) if userKey]
+                
+                for userKey in userKeys[1:]:
+                    
+                    wantedLinks.add((userKeys[0], userKey, 'DATA'))
+    
+    objectNodes = [node for node in nodesByKey.values() if node.bl_idname == 'ObjectNodeType']
+    
+    for node in objectNodes:
+        
+        for socket in node.outputs:
+            
+            relation = dependencyRelations.get(socket.name)
+            
+            if relation is None:
+                
+                continue
+            
+            for link in list(socket.links):
+                
+                linkKey = (getNodeKey(node), getNodeKey(link.to_node), relation)
+                
+                #Links that are already there are taken off the list, so duplicates go too
+                if linkKey in wantedLinks:
+                    
+                    wantedLinks.remove(linkKey)
+                    
+                else:
+                    
+                    nodeGroup.links.remove(link)
+    
+    for targetKey, dependentKey, relation in wantedLinks:
+        
+        linkDependency(nodeGroup, nodesByKey[targetKey], nodesByKey[dependentKey], relation)
+    
+    #Sockets left without links go, so edge types that were turned off leave nothing behind
+    for node in objectNodes:
+        
+        for sockets in (node.inputs, node.outputs):
+            
+            for socket in [socket for socket in sockets if socket.name in dependencyLabels and not socket.is_linked]:
+                
+                sockets.remove(socket)
+
+
+
+def linkDependency(nodeGroup, targetNode, dependentNode, relation):
+    
+    nodeGroup.links.new(getDependencySocket(targetNode.outputs, relation), getDependencySocket(dependentNode.inputs, relation))
+    profiler.count("dependency links")
+
+
+
+def getDependencyIndex(nodeGroup):
+    
+    index = dependencyIndexes.get(nodeGroup.name)
+    
+    if index is None:
+        
+        index = dependencyIndexes[nodeGroup.name] = SceneIndex.build(getTreeScenes(nodeGroup), True)
+    
+    return index
+
+
+
+#Materials with more users than the threshold show a count instead of a link
+#from every user, until the user asks for the links
+def setMaterialUsers(materialNode, userCount, bundleThreshold):
+    
+    bundled = bundleThreshold > 0 and userCount > bundleThreshold
+    
+    if materialNode.userCount != userCount:
+        
+        materialNode.userCount = userCount
+    
+    if materialNode.bundled != bundled:
+        
+        materialNode.bundled = bundled
+
+
+
+def materialShowsLinks(materialNode):
+    
+    return not materialNode.bundled or materialNode.linksShown
+
+
+
+def getBundleThreshold():
+    
+    return getPreferences().material_bundle_threshold
+
+
+
+#Puts a node that has just been added to an existing tree below its siblings
+def placeNewNode(node, parentNode):
+    
+    if parentNode.bl_idname == 'SceneNodeType':
+        
+        node.location[0] = parentNode.location[0] + parentNode.width + 80
+        
+    else:
+        
+        node.location[0] = parentNode.location[0] + node.width + 120
+    
+    siblings = [link.to_node for link in parentNode.outputs[0].links if link.to_node != node]
+    
+    if len(siblings) == 0:
+        
+        node.location[1] = parentNode.location[1]
+        
+    else:
+        
+        node.location[1] = min(sibling.location[1] for sibling in siblings) - 140
+
+
+
+def syncGraph(nodeGroup):
+    
+    changes = {"added": 0, "removed": 0, "relinked": 0, "recoloured": 0}
+    
+    existingNodes = {}
+    staleNodes = []
+    
+    for node in nodeGroup.nodes:
+        
+        key = getNodeKey(node)
+        
+        if key is None or key in existingNodes:
+            
+            staleNodes.append(node)
+            
+        else:
+            
+            existingNodes[key] = node
+    
+    
+    #Work out what the tree should look like from the current data
+    index = SceneIndex.build(getTreeScenes(nodeGroup), len(nodeGroup.dependency_edges) > 0)
+    
+    wantedScenes = []
+    wantedObjects = {}
+    wantedMaterials = {}
+    objectOrder = []
+    forests = []
+    
+    for scene in index.scenes:
+        
+        sceneKey = ('SCENE', scene.name)
+        wantedScenes.append((sceneKey, scene))
+        
+        forest = SceneForest(index, scene)
+        forests.append(forest)
+        graphMaterials = forest.graphFilter.materials
+        
+        #Nodes that are already in the tree keep the user's expanded/collapsed state
+        def showChildren(object, depth, scene=scene):
+            
+            node = existingNodes.get(('OBJECT', scene.name, object.name))
+            
+            if node:
+                
+                return node.childrenShown
+            
+            return childrenShownByDefault(scene, depth)
+        
+        #The forest is walked parent first, so parents are always handled before their children
+        for object, depth in forest.walk(showChildren):
+            
+            objectKey = ('OBJECT', scene.name, object.name)
+            parent = forest.parents[object.name]
+            
+            if parent:
+                
+                parentKey = ('OBJECT', scene.name, parent.name)
+                
+            else:
+                
+                parentKey = sceneKey
+            
+            materialKeys = []
+            
+            if graphMaterials:
+                
+                for material in index.getObjectMaterials(object):
+                    
+                    materialKey = ('MATERIAL', material.name)
+                    wantedMaterials[materialKey] = material
+                    materialKeys.append(materialKey)
+            
+            if showChildren(object, depth):
+                
+                hiddenChildren = 0
+                
+            else:
+                
+                hiddenChildren = len(forest.children.get(object.name, []))
+            
+            wantedObjects[objectKey] = (scene, object, parentKey, materialKeys, hiddenChildren)
+            objectOrder.append(objectKey)
+    
+    wantedSceneKeys = set(sceneKey for sceneKey, scene in wantedScenes)
+    
+    
+    for key, node in existingNodes.items():
+        
+        if key not in wantedObjects and key not in wantedMaterials and key not in wantedSceneKeys:
+            
+            staleNodes.append(node)
+    
+    for node in staleNodes:
+        
+        existingNodes.pop(getNodeKey(node), None)
+        nodeGroup.nodes.remove(node)
+        changes["removed"] += 1
+    
+    
+    #User counts can change without the material nodes changing
+    bundleThreshold = getBundleThreshold()
+    heatmapOff = not nodeGroup.show_statistics or nodeGroup.colour_mode == 'TYPE'
+    
+    for materialKey, material in wantedMaterials.items():
+        
+        if materialKey in existingNodes:
+            
+            setMaterialUsers(existingNodes[materialKey], len(index.materialUsers[material.name]), bundleThreshold)
+    
+    
+    newNodes = set()
+    newMaterialNodes = []
+    
+    for sceneKey, scene in wantedScenes:
+        
+        if sceneKey not in existingNodes:
+            
+            sceneNode = newSceneNode(nodeGroup, scene)
+            
+            sceneNodes = [node for node in existingNodes.values() if node.bl_idname == 'SceneNodeType']
+            
+            if len(sceneNodes) > 0:
+                
+                sceneNode.location[1] = min(node.location[1] for node in sceneNodes) - sceneNode.height
+            
+            existingNodes[sceneKey] = sceneNode
+            changes["added"] += 1
+    
+    
+    for objectKey in objectOrder:
+        
+        scene, object, parentKey, materialKeys, hiddenChildren = wantedObjects[objectKey]
+        parentNode = existingNodes[parentKey]
+        
+        if objectKey not in existingNodes:
+            
+            objectNode = newObjectNode(nodeGroup, scene, object)
+            objectNode.childrenShown = hiddenChildren == 0
+            existingNodes[objectKey] = objectNode
+            newNodes.add(objectKey)
+            changes["added"] += 1
+            
+        else:
+            
+            objectNode = existingNodes[objectKey]
+            colour = getNodeColour(object.type)
+            
+            #Heatmap colours are worked out over the whole tree once new nodes have
+            #their statistics
+            if heatmapOff and tuple(objectNode.color) != tuple(colour):
+                
+                objectNode.use_custom_color = True
+                objectNode.color = colour
+                changes["recoloured"] += 1
+            
+            if hasMaterialSocket(object) and getMaterialSocket(objectNode) is None:
+                
+                objectNode.outputs.new('NodeSocketFloat', "Material")
+        
+        if objectNode.hiddenChildren != hiddenChildren:
+            
+            objectNode.hiddenChildren = hiddenChildren
+        
+        
+        parentLinks = objectNode.inputs[0].links
+        
+        if len(parentLinks) != 1 or parentLinks[0].from_node != parentNode:
+            
+            for link in list(parentLinks):
+                
+                nodeGroup.links.remove(link)
+            
+            linkParent(nodeGroup, objectNode, parentNode)
+            
+            if objectKey not in newNodes:
+                
+                changes["relinked"] += 1
+        
+        if objectKey in newNodes:
+            
+            placeNewNode(objectNode, parentNode)
+        
+        
+        materialSocket = getMaterialSocket(objectNode)
+        
+        if materialSocket:
+            
+            linkedMaterials = set()
+            
+            for link in list(materialSocket.links):
+                
+                materialKey = getNodeKey(link.to_node)
+                
+                if materialKey in materialKeys and materialKey not in linkedMaterials and materialShowsLinks(link.to_node):
+                    
+                    linkedMaterials.add(materialKey)
+                    
+                else:
+                    
+                    nodeGroup.links.remove(link)
+            
+            for materialKey in materialKeys:
+                
+                if materialKey in linkedMaterials:
+                    
+                    continue
+                
+                if materialKey not in existingNodes:
+                    
+                    material = wantedMaterials[materialKey]
+                    
+                    existingNodes[materialKey] = newMaterialNode(nodeGroup, material)
+                    newMaterialNodes.append(existingNodes[materialKey])
+                    placeMaterialNode(existingNodes[materialKey], objectNode)
+                    setMaterialUsers(existingNodes[materialKey], len(index.materialUsers[material.name]), bundleThreshold)
+                    changes["added"] += 1
+                
+                if materialShowsLinks(existingNodes[materialKey]):
+                    
+                    nodeGroup.links.new(existingNodes[materialKey].inputs[0], materialSocket)
+    
+    updateStatistics(nodeGroup, [existingNodes[objectKey] for objectKey in newNodes] + newMaterialNodes)
+    
+    linkDependencies(nodeGroup, index, existingNodes)
+    updateSearchIndex(nodeGroup, index, forests, existingNodes.values())
+    
+    return changes
+
+
+
+#Brings the nodes of objects whose signature changed up to date, without working
+#out the rest of the tree again. changedObjects maps object names to (object,
+#signature at the last check). Returns False as soon as a change reaches further
+#than the objects' own nodes and links, leaving the tree to a full sync
+def syncObjects(nodeGroup, changedObjects):
+    
+    nodesByKey = dict((getNodeKey(node), node) for node in nodeGroup.nodes)
+    graphFilters = [GraphFilter(scene) for scene in getTreeScenes(nodeGroup)]
+    bundleThreshold = getBundleThreshold()
+    heatmapOff = not nodeGroup.show_statistics or nodeGroup.colour_mode == 'TYPE'
+    
+    changedNodes = []
+    targetsChanged = False
+    
+    for object, oldSignature in changedObjects.values():
+        
+        #New or renamed objects need nodes, which only a full sync places
+        if oldSignature is None:
+            
+            return False
+        
+        signature = objectSignatures[object.name]
+        parentChanged = signature[0] != oldSignature[0]
+        objectMaterials = []
+        
+        for materialName in signature[2]:
+            
+            if materialName not in objectMaterials:
+                
+                objectMaterials.append(materialName)
+        
+        graphed = False
+        graphedMaterials = False
+        
+        for graphFilter in graphFilters:
+            
+            scene = graphFilter.scene
+            
+            if scene.objects.get(object.name) != object:
+                
+                continue
+            
+            node = nodesByKey.get(('OBJECT', scene.name, object.name))
+            
+            if not graphFilter.includes(object):
+                
+                #Hidden objects pass their graphed children on to their ancestors
+                if node or (graphFilter.parentChain and parentChanged and len(object.children) > 0):
+                    
+                    return False
+                
+                continue
+            
+            parent = graphFilter.getGraphedParent(object)
+            
+            if parent:
+                
+                parentNode = nodesByKey.get(('OBJECT', scene.name, parent.name))
+                
+            else:
+                
+                parentNode = nodesByKey.get(('SCENE', scene.name))
+            
+            parentShowsChildren = parentNode is not None and (parentNode.bl_idname != 'ObjectNodeType' or parentNode.childrenShown)
+            
+            if node is None:
+                
+                #Still inside a folded branch, which only keeps a count of its children
+                if parent and not parentShowsChildren and not parentChanged:
+                    
+                    continue
+                
+                return False
+            
+            if not parentShowsChildren:
+                
+                return False
+            
+            graphed = True
+            
+            parentLinks = node.inputs[0].links
+            
+            if len(parentLinks) != 1 or parentLinks[0].from_node != parentNode:
+                
+                for link in list(parentLinks):
+                    
+                    nodeGroup.links.remove(link)
+                
+                linkParent(nodeGroup, node, parentNode)
+            
+            colour = getNodeColour(object.type)
+            
+            if heatmapOff and tuple(node.color) != tuple(colour):
+                
+                node.use_custom_color = True
+                node.color = colour
+            
+            materialSocket = getMaterialSocket(node)
+            
+            if hasMaterialSocket(object) and materialSocket is None:
+                
+                materialSocket = node.outputs.new('NodeSocketFloat', "Material")
+            
+            if graphFilter.materials and materialSocket:
+                
+                graphedMaterials = True
+                materialKeys = [('MATERIAL', materialName) for materialName in objectMaterials]
+                
+                #Materials nothing else uses yet need new nodes
+                if any(materialKey not in nodesByKey for materialKey in materialKeys):
+                    
+                    return False
+                
+                for link in list(materialSocket.links):
+                    
+                    if getNodeKey(link.to_node) not in materialKeys:
+                        
+                        nodeGroup.links.remove(link)
+                
+                linkedKeys = set(getNodeKey(link.to_node) for link in materialSocket.links)
+                
+                for materialKey in materialKeys:
+                    
+                    if materialKey not in linkedKeys and materialShowsLinks(nodesByKey[materialKey]):
+                        
+                        nodeGroup.links.new(nodesByKey[materialKey].inputs[0], materialSocket)
+            
+            if signature[1] != oldSignature[1] or signature[2] != oldSignature[2]:
+                
+                changedNodes.append(node)
+        
+        #Each graphed object counts once towards a material's users, however many
+        #scenes it's in
+        if graphedMaterials:
+            
+            for materialName in set(signature[2]) ^ set(oldSignature[2]):
+                
+                materialNode = nodesByKey.get(('MATERIAL', materialName))
+                
+                if materialNode is None:
+                    
+                    return False
+                
+                userCount = materialNode.userCount + (1 if materialName in signature[2] else -1)
+                
+                #Unused material nodes go, and bundling changes every user's links
+                if userCount <= 0 or (bundleThreshold > 0 and userCount > bundleThreshold) != materialNode.bundled:
+                    
+                    return False
+                
+                setMaterialUsers(materialNode, userCount, bundleThreshold)
+        
+        if graphed and signature[3] != oldSignature[3]:
+            
+            targetsChanged = True
+    
+    if targetsChanged and len(nodeGroup.dependency_edges) > 0:
+        
+        #The update that changed the targets hasn't cleared the cached index yet
+        dependencyIndexes.pop(nodeGroup.name, None)
+        
+        linkDependencies(nodeGroup, getDependencyIndex(nodeGroup), nodesByKey)
+    
+    updateStatistics(nodeGroup, changedNodes)
+    
+    return True
+
+
+
+#Builds the whole graph, yielding (objects done, total objects) after every
+#object so it can also be run a slice at a time. Parents are always created
+#before their children, so stopping early still leaves a consistent tree.
+#Nodes from the previous graph are reused where possible
+def buildGraph(nodeGroup, useLayoutCache=True):
+    
+    layoutCache = LayoutCache(nodeGroup, useLayoutCache)
+    
+    if useLayoutCache:
+        
+        layoutCache.remember(nodeGroup)
+    
+    #Links are cheap to make again, nodes aren't, so only the links start from scratch
+    nodeGroup.links.clear()
+    
+    pool = NodePool(nodeGroup)
+    
+    try:
+        
+        yield from buildNodes(nodeGroup, pool, layoutCache)
+        
+        #A cancelled or failed run only placed part of the graph, so it keeps the
+        #stored cache rather than dropping everything it didn't reach
+        layoutCache.save(nodeGroup)
+        
+    finally:
+        
+        with profiler.phase("cleanup"):
+            
+            #Set again in case anything cleared it mid-run, or freeing the leftover
+            #nodes would delete their objects
+            setGraphing(True)
+            
+            pool.release()
+
+
+
+def buildNodes(nodeGroup, pool, layoutCache):
+    
+    with profiler.phase("index"):
+        
+        index = SceneIndex.build(getTreeScenes(nodeGroup), len(nodeGroup.dependency_edges) > 0)
+    
+    with profiler.phase("hierarchy"):
+        
+        forests = [SceneForest(index, scene) for scene in index.scenes]
+        
+        pool.keepOnly(getWantedKeys(index, forests))
+    
+    total = sum(len(forest.parents) for forest in forests)
+    done = 0
+    
+    materialNodes = {}
+    bundleThreshold = getBundleThreshold()
+    
+    row = 0
+
+
+    for forest in forests:
+        
+        scene = forest.scene
+        
+        def showChildren(object, depth, scene=scene):
+            
+            return childrenShownByDefault(scene, depth)
+        
+        with profiler.phase("layout"):
+            
+            layout = SceneLayout(forest, row, showChildren)
+            hashes = getSubtreeHashes(forest, index, showChildren)
+            
+            sceneLocation, locations = layoutCache.placeScene(scene, forest, layout, hashes, showChildren)
+        
+        row = layout.lastRow + 1
+        
+        sceneNode = newSceneNode(nodeGroup, scene, pool)
+        sceneNode.location = sceneLocation
+        
+        objectNodes = {}
+                                              
+        for object, depth in forest.walk(showChildren):
+            
+            profiler.count("objects")
+            
+            with profiler.phase("nodes"):
+                
+                objectNode = newObjectNode(nodeGroup, scene, object, pool)
+                objectNode.location = locations[object.name]
+                objectNodes[object.name] = objectNode
+            
+            if nodeGroup.show_statistics:
+                
+                with profiler.phase("statistics"):
+                    
+                    setObjectStatistics(objectNode, object, scene)
+           
+            #print("Correct: Looking on object "+object.name+", node "+objectNode.name)
+            
+            parent = forest.parents[object.name]
+            
+            with profiler.phase("links"):
+                   
+                if parent == None:
+                    
+                    linkParent(nodeGroup, objectNode, sceneNode)
+                    
+                else:
+                    
+                    linkParent(nodeGroup, objectNode, objectNodes[parent.name])
+                
+                profiler.count("links")
+            
+            if not showChildren(object, depth):
+                
+                objectNode.childrenShown = False
+                objectNode.hiddenChildren = len(forest.children.get(object.name, []))
+                
+                #Collapsed branches count as done straight away
+                done = done + len(list(forest.walk(roots=[object]))) - 1
+             
+            if forest.graphFilter.materials:
+                
+                with profiler.phase("materials"):
+                    
+                    linkMaterials(nodeGroup, objectNode, index.getObjectMaterials(object), materialNodes, index.materialUsers, bundleThreshold, pool)
+            
+            done = done + 1
+            
+            yield done, total
+    
+    
+    for material, materialNode in materialNodes.items():
+        
+        layoutCache.placeMaterial(materialNode)
+        
+        if nodeGroup.show_statistics:
+            
+            setMaterialStatistics(materialNode, index.materials[material])
+    
+    if nodeGroup.show_statistics and nodeGroup.colour_mode != 'TYPE':
+        
+        #Leftovers from the last run would skew the scale, so only this run's nodes count
+        heatmapNodes = [node for node in pool.boundNodes.values() if node.bl_idname in ('ObjectNodeType', 'MaterialNodeType')]
+        
+        applyHeatmap(heatmapNodes, [getHeatmapValue(node, nodeGroup.colour_mode) for node in heatmapNodes])
+    
+    #The pool's leftovers are still in the tree until it's released, so only
+    #the nodes bound by this run are linked and indexed
+    with profiler.phase("dependencies"):
+        
+        linkDependencies(nodeGroup, index, pool.boundNodes)
+    
+    with profiler.phase("search index"):
+        
+        updateSearchIndex(nodeGroup, index, forests, pool.boundNodes.values())
+
+
+
+#Graphing operators only change nodes that can be made again from the scene,
+#so they stay off the undo stack, where each step would hold a copy of the
+#whole tree
+def pushGraphUndo(message):
+    
+    if getPreferences().undo_graphing:
+        
+        pushDataUndo(message)
+
+
+
+#Deletions and reparenting made through the nodes are applied after the node
+#editor's own undo step was pushed, so they need a step of their own
+def pushDataUndo(message):
+    
+    if not bpy.app.background and bpy.ops.ed.undo_push.poll():
+        
+        bpy.ops.ed.undo_push(message=message)
+
+
+
+def getSceneTrees():
+    
+    return [nodeGroup for nodeGroup in bpy.data.node_groups if nodeGroup.bl_idname == 'SceneTreeType']
+
+
+
+def getEditedTree(context):
+    
+    space = context.space_data
+    
+    if space is not None and space.type == 'NODE_EDITOR':
+        
+        nodeGroup = space.edit_tree
+        
+        return nodeGroup if nodeGroup and nodeGroup.bl_idname == 'SceneTreeType' else None
+    
+    #Scripts and background runs have no editor to ask, so they get the first scene tree
+    sceneTrees = getSceneTrees()
+    
+    return sceneTrees[0] if sceneTrees else None
+
+
+
+#Nothing else may change the graph while a background run is building it
+def canEditGraph(context):
+    
+    return not context.window_manager.graph_running and getEditedTree(context) is not None
+
+
+
+def getOperatorTree(operator, context):
+    
+    #Node buttons name their own tree, which needn't be the one being edited
+    if operator.tree_name in bpy.data.node_groups:
+        
+        return bpy.data.node_groups[operator.tree_name]
+    
+    return getEditedTree(context)
+
+
+
+def getTreeScenes(nodeGroup):
+    
+    if nodeGroup.scope == 'SCENE':
+        
+        scene = bpy.data.scenes.get(nodeGroup.scope_scene)
+        
+        return [scene] if scene else [bpy.context.scene]
+    
+    if nodeGroup.scope == 'SCENES':
+        
+        names = [name.strip() for name in nodeGroup.scope_scenes.split(",")]
+        
+        return [scene for scene in bpy.data.scenes if scene.name in names]
+    
+    return list(bpy.data.scenes)
+
+
+
+class GraphScene(bpy.types.Operator):
+    """Add a simple box mesh"""
+    bl_idname = "scene_nodes.graph_scene"
+    bl_label = "Add Box"
+    bl_options = {'REGISTER'}
+    
+    relayout = bpy.props.BoolProperty(name="Lay Out Again", description="Ignore the locations remembered from earlier runs", default=False)
+    
+    
+    @classmethod
+    def poll(cls, context):
+        
+        return canEditGraph(context)
+
+
+    def execute(self, context):
+        
+        startProfiling("Graph scene")
+        
+        #Stops objects from being deleted when old nodes are removed
+        with GraphingGuard():
+            
+            nodeGroup = getEditedTree(context)
+            
+            for progress in buildGraph(nodeGroup, not self.relayout):
+                
+                pass
+        
+        stopProfiling(self)
+        
+        pushGraphUndo("Graph Scene")
+            
+        return {'FINISHED'}
+
+
+
+class GraphSceneBackground(bpy.types.Operator):
+    """Graph the scene a few nodes at a time without blocking the interface. Esc cancels"""
+    bl_idname = "scene_nodes.graph_scene_background"
+    bl_label = "Graph Scene In Background"
+    bl_options = {'REGISTER'}
+    
+    batch_size = bpy.props.IntProperty(name="Batch Size", description="Objects graphed per timer tick", default=250, min=1)
+    
+    
+    @classmethod
+    def poll(cls, context):
+        
+        return canEditGraph(context)
+    
+    
+    def invoke(self, context, event):
+        
+        startProfiling("Graph scene in background")
+        
+        setGraphing(True)
+        
+        self.graphBuilder = buildGraph(getEditedTree(context))
+        
+        windowManager = context.window_manager
+        windowManager.graph_running = True
+        windowManager.graph_progress = 0
+        
+        self.timer = windowManager.event_timer_add(0.01, context.window)
+        windowManager.modal_handler_add(self)
+        
+        return {'RUNNING_MODAL'}
+    
+    
+    def modal(self, context, event):
+        
+        if event.type == 'ESC':
+            
+            self.finish(context)
+            self.report({'INFO'}, "Graphing cancelled")
+            
+            return {'CANCELLED'}
+        
+        if event.type == 'TIMER':
+            
+            for step in range(self.batch_size):
+                
+                #The guard is only cleared by finish, so it has to run whatever happens
+                try:
+                    
+                    progress = next(self.graphBuilder, None)
+                    
+                except Exception:
+                    
+                    self.finish(context)
+                    raise
+                
+                if progress is None:
+                    
+                    self.finish(context)
+                    
+                    return {'FINISHED'}
+                
+                done, total = progress
+                
+                context.window_manager.graph_progress = done / total
+            
+            redrawNodeEditors(context)
+        
+        #Let the user keep navigating while the graph fills in, but nothing else,
+        #as edits would change nodes the run is still holding on to
+        if event.type in navigationEvents or event.type.startswith("NDOF_"):
+            
+            return {'PASS_THROUGH'}
+        
+        return {'RUNNING_MODAL'}
+    
+    
+    def finish(self, context):
+        
+        self.graphBuilder.close()
+        
+        windowManager = context.window_manager
+        windowManager.event_timer_remove(self.timer)
+        windowManager.graph_running = False
+        
+        setGraphing(False)
+        
+        stopProfiling(self)
+        
+        pushGraphUndo("Graph Scene")
+        
+        redrawNodeEditors(context)
+
+
+
+navigationEvents = {'MOUSEMOVE', 'INBETWEEN_MOUSEMOVE', 'MIDDLEMOUSE', 'WHEELUPMOUSE', 'WHEELDOWNMOUSE', 'TRACKPADPAN', 'TRACKPADZOOM', 'HOME'}
+
+
+
+def redrawNodeEditors(context):
+    
+    for area in context.screen.areas:
+        
+        if area.type == 'NODE_EDITOR':
+            
+            area.tag_redraw()
+
+
+
+class SyncSceneGraph(bpy.types.Operator):
+    """Update the scene graph to match the scene, only changing what's different"""
+    bl_idname = "scene_nodes.sync_graph"
+    bl_label = "Sync Scene Graph"
+    bl_options = {'REGISTER'}
+    
+    
+    @classmethod
+    def poll(cls, context):
+        
+        return canEditGraph(context)
+
+
+    def execute(self, context):
+        
+        startProfiling("Sync scene graph")
+        
+        with GraphingGuard():
+            
+            with profiler.phase("sync"):
+                
+                changes = syncGraph(getEditedTree(context))
+        
+        stopProfiling(self)
+        
+        pushGraphUndo("Sync Scene Graph")
+        
+        self.report({'INFO'}, "Added "+str(changes["added"])+", removed "+str(changes["removed"])+", relinked "+str(changes["relinked"])+" nodes")
+        
+        return {'FINISHED'}
+
+
+
+class ExpandObjectNode(bpy.types.Operator):
+    """Create the nodes for this object's children"""
+    bl_idname = "scene_nodes.expand_node"
+    bl_label = "Expand Node"
+    bl_options = {'REGISTER'}
+    
+    node_name = bpy.props.StringProperty()
+    tree_name = bpy.props.StringProperty()
+    
+    
+    @classmethod
+    def poll(cls, context):
+        
+        return not context.window_manager.graph_running
+
+
+    def execute(self, context):
+        
+        nodeGroup = getOperatorTree(self, context)
+        node = nodeGroup.nodes[self.node_name]
+        
+        object = node.resolveObject()[0]
+        
+        if object is None:
+            
+            self.report({'WARNING'}, node.objectIndex+" is missing")
+            
+            return {'CANCELLED'}
+        
+        scene = bpy.data.scenes[node.scene]
+        
+        index = SceneIndex()
+        index.addScene(scene)
+        
+        forest = SceneForest(index, scene)
+        children = forest.children.get(object.name, [])
+        
+        if len(children) == 0:
+            
+            node.childrenShown = True
+            node.hiddenChildren = 0
+            
+            return {'CANCELLED'}
+        
+        #The same depth limit applies again, counting from the expanded node
+        def showChildren(object, depth):
+            
+            return childrenShownByDefault(scene, depth)
+        
+        layout = SceneLayout(forest, 0, showChildren, roots=children)
+        
+        #Layouts start at the scene node, so move this one next to the expanded node
+        offsetX = node.location[0] + NODE_WIDTH + 120 - layout.locations[children[0].name][0]
+        offsetY = node.location[1] - layout.sceneLocation[1]
+        
+        materialNodes = dict((materialNode.materialIndex, materialNode) for materialNode in nodeGroup.nodes if materialNode.bl_idname == 'MaterialNodeType')
+        existingMaterials = set(materialNodes)
+        
+        with GraphingGuard():
+            
+            objectNodes = {object.name: node}
+            
+            for child, depth in forest.walk(showChildren, roots=children):
+                
+                childNode = newObjectNode(nodeGroup, scene, child)
+                
+                x, y = layout.locations[child.name]
+                childNode.location = (x + offsetX, y + offsetY)
+                
+                objectNodes[child.name] = childNode
+                
+                linkParent(nodeGroup, childNode, objectNodes[forest.parents[child.name].name])
+                
+                if not showChildren(child, depth):
+                    
+                    childNode.childrenShown = False
+                    childNode.hiddenChildren = len(forest.children.get(child.name, []))
+                
+                if forest.graphFilter.materials:
+                    
+                    linkMaterials(nodeGroup, childNode, index.getObjectMaterials(child), materialNodes, index.materialUsers, getBundleThreshold())
+            
+            node.childrenShown = True
+            node.hiddenChildren = 0
+            
+            #Dependencies can reach nodes in any scene the tree graphs, so they're
+            #worked out over the whole tree rather than this scene's index
+            if len(nodeGroup.dependency_edges) > 0:
+                
+                linkDependencies(nodeGroup, getDependencyIndex(nodeGroup), dict((getNodeKey(treeNode), treeNode) for treeNode in nodeGroup.nodes))
+        
+        newNodes = [childNode for childNode in objectNodes.values() if childNode != node]
+        newNodes.extend(materialNode for material, materialNode in materialNodes.items() if material not in existingMaterials)
+        
+        updateStatistics(nodeGroup, newNodes)
+        
+        pushGraphUndo("Expand Node")
+        
+        return {'FINISHED'}
+
+
+
+class CollapseObjectNode(bpy.types.Operator):
+    """Remove the nodes below this object, without touching the objects themselves"""
+    bl_idname = "scene_nodes.collapse_node"
+    bl_label = "Collapse Node"
+    bl_options = {'REGISTER'}
+    
+    node_name = bpy.props.StringProperty()
+    tree_name = bpy.props.StringProperty()
+    
+    
+    @classmethod
+    def poll(cls, context):
+        
+        return not context.window_manager.graph_running
+
+
+    def execute(self, context):
+        
+        nodeGroup = getOperatorTree(self, context)
+        node = nodeGroup.nodes[self.node_name]
+        
+        descendants = []
+        #Material nodes by pointer, as folded objects can share materials
+        materialNodes = {}
+        
+        stack = [node]
+        
+        while stack:
+            
+            for link in stack.pop().outputs[0].links:
+                
+                descendants.append(link.to_node)
+                stack.append(link.to_node)
+        
+        for descendant in descendants:
+            
+            materialSocket = getMaterialSocket(descendant)
+            
+            if materialSocket:
+                
+                for link in materialSocket.links:
+                    
+                    materialNodes[link.to_node.as_pointer()] = link.to_node
+        
+        with GraphingGuard():
+            
+            node.childrenShown = False
+            node.hiddenChildren = len(node.outputs[0].links)
+            
+            for descendant in descendants:
+                
+                nodeGroup.nodes.remove(descendant)
+            
+            #Material nodes only used by the folded branch go too
+            for materialNode in materialNodes.values():
+                
+                if len(materialNode.inputs[0].links) == 0:
+                    
+                    nodeGroup.nodes.remove(materialNode)
+        
+        pushGraphUndo("Collapse Node")
+        
+        return {'FINISHED'}
+
+
+
+class ShowMaterialLinks(bpy.types.Operator):
+    """Link this material to every object node that uses it"""
+    bl_idname = "scene_nodes.show_material_links"
+    bl_label = "Show Material Links"
+    bl_options = {'REGISTER'}
+    
+    node_name = bpy.props.StringProperty()
+    tree_name = bpy.props.StringProperty()
+    
+    
+    @classmethod
+    def poll(cls, context):
+        
+        return not context.window_manager.graph_running
+
+
+    def execute(self, context):
+        
+        nodeGroup = getOperatorTree(self, context)
+        materialNode = nodeGroup.nodes[self.node_name]
+        material = materialNode.resolveMaterial()[0]
+        
+        if material is None:
+            
+            self.report({'WARNING'}, materialNode.materialIndex+" is missing")
+            
+            return {'CANCELLED'}
+        
+        users = set(object.name for object in bpy.data.objects if material.name in object.material_slots)
+        
+        userNodes = [node for node in nodeGroup.nodes if node.bl_idname == 'ObjectNodeType' and node.objectIndex in users and getMaterialSocket(node)]
+        
+        if len(userNodes) > MAX_MATERIAL_LINKS:
+            
+            self.report({'WARNING'}, "Only the first "+str(MAX_MATERIAL_LINKS)+" of "+str(len(userNodes))+" users can be linked")
+            
+            userNodes = userNodes[:MAX_MATERIAL_LINKS]
+        
+        with GraphingGuard():
+            
+            materialNode.linksShown = True
+            
+            for userNode in userNodes:
+                
+                nodeGroup.links.new(materialNode.inputs[0], getMaterialSocket(userNode))
+        
+        pushGraphUndo("Show Material Links")
+        
+        return {'FINISHED'}
+
+
+
+class HideMaterialLinks(bpy.types.Operator):
+    """Replace this material's links with a count of its users"""
+    bl_idname = "scene_nodes.hide_material_links"
+    bl_label = "Hide Material Links"
+    bl_options = {'REGISTER'}
+    
+    node_name = bpy.props.StringProperty()
+    tree_name = bpy.props.StringProperty()
+    
+    
+    @classmethod
+    def poll(cls, context):
+        
+        return not context.window_manager.graph_running
+
+
+    def execute(self, context):
+        
+        nodeGroup = getOperatorTree(self, context)
+        materialNode = nodeGroup.nodes[self.node_name]
+        
+        with GraphingGuard():
+            
+            materialNode.linksShown = False
+            
+            for link in list(materialNode.inputs[0].links):
+                
+                nodeGroup.links.remove(link)
+        
+        pushGraphUndo("Hide Material Links")
+        
+        return {'FINISHED'}
+
+
+
+def getSearchItems(self, context):
+    
+    nodeGroup = getEditedTree(context)
+    
+    if nodeGroup is None:
+        
+        return []
+    
+    return getSearchIndex(nodeGroup).getItems()
+
+
+
+class FindNode(bpy.types.Operator):
+    """Jump to the node of a scene, object or material by name"""
+    bl_idname = "scene_nodes.find_node"
+    bl_label = "Find Node"
+    bl_property = "entry"
+    
+    entry = bpy.props.EnumProperty(name="Node", items=getSearchItems)
+    query = bpy.props.StringProperty(name="Name", description="Jump to the best match for this text instead of showing the search popup")
+    expand_ancestors = bpy.props.BoolProperty(name="Expand Ancestors", description="Expand folded parents to show the node", default=True)
+    
+    
+    @classmethod
+    def poll(cls, context):
+        
+        return canEditGraph(context)
+    
+    
+    def invoke(self, context, event):
+        
+        if self.query:
+            
+            return self.execute(context)
+        
+        context.window_manager.invoke_search_popup(self)
+        
+        return {'RUNNING_MODAL'}
+    
+    
+    def execute(self, context):
+        
+        nodeGroup = getEditedTree(context)
+        searchIndex = getSearchIndex(nodeGroup)
+        
+        if self.query:
+            
+            results = searchIndex.search(self.query, 1)
+            
+            if len(results) == 0:
+                
+                self.report({'WARNING'}, "Nothing called "+self.query+" is graphed")
+                
+                return {'CANCELLED'}
+            
+            entryIndex = results[0]
+            
+        else:
+            
+            entryIndex = int(self.entry)
+        
+        name, label, key = searchIndex.entries[entryIndex]
+        
+        node = searchIndex.findNode(nodeGroup, key)
+        
+        if node is None and key[0] == 'OBJECT' and self.expand_ancestors:
+            
+            node = self.expandTo(nodeGroup, searchIndex, key)
+        
+        if node is None:
+            
+            self.report({'WARNING'}, label+" is in a folded branch")
+            
+            return {'CANCELLED'}
+        
+        for otherNode in nodeGroup.nodes:
+            
+            otherNode.select = False
+        
+        node.select = True
+        nodeGroup.nodes.active = node
+        
+        if context.space_data and context.space_data.type == 'NODE_EDITOR':
+            
+            bpy.ops.node.view_selected()
+        
+        return {'FINISHED'}
+    
+    
+    #Expands the folded ancestors of an object from the nearest one with a node down
+    def expandTo(self, nodeGroup, searchIndex, key):
+        
+        scene = bpy.data.scenes.get(key[1])
+        
+        if scene is None or key[2] not in scene.objects:
+            
+            return None
+        
+        index = SceneIndex()
+        index.addScene(scene)
+        
+        forest = SceneForest(index, scene)
+        
+        chain = [scene.objects[key[2]]]
+        node = None
+        
+        while node is None:
+            
+            parent = forest.parents.get(chain[-1].name)
+            
+            if parent is None:
+                
+                return None
+            
+            node = searchIndex.findNode(nodeGroup, ('OBJECT', scene.name, parent.name))
+            
+            if node is None:
+                
+                chain.append(parent)
+        
+        for object in reversed(chain):
+            
+            if node.hiddenChildren > 0:
+                
+                bpy.ops.scene_nodes.expand_node(node_name=node.name, tree_name=nodeGroup.name)
+            
+            children = [link.to_node for link in node.outputs[0].links if link.to_node.objectIndex == object.name]
+            
+            if len(children) == 0:
+                
+                return None
+            
+            node = children[0]
+            searchIndex.noteNodes([node])
+        
+        return node
+
+
+
+class FindDependents(bpy.types.Operator):
+    """Select every object depending on the active node's object through modifiers, constraints, drivers or shared data"""
+    bl_idname = "scene_nodes.find_dependents"
+    bl_label = "Find Dependents"
+    
+    indirect = bpy.props.BoolProperty(name="Indirect", description="Also find the objects depending on the dependents", default=True)
+    
+    
+    @classmethod
+    def poll(cls, context):
+        
+        nodeGroup = getEditedTree(context)
+        
+        return nodeGroup is not None and nodeGroup.nodes.active is not None and nodeGroup.nodes.active.bl_idname == 'ObjectNodeType'
+    
+    
+    def execute(self, context):
+        
+        nodeGroup = getEditedTree(context)
+        node = nodeGroup.nodes.active
+        
+        object = node.resolveObject()[0]
+        
+        if object is None:
+            
+            self.report({'WARNING'}, node.objectIndex+" is missing")
+            
+            return {'CANCELLED'}
+        
+        scene = bpy.data.scenes[node.scene]
+        
+        #The index is made once, so each query only visits the dependents it finds
+        index = getDependencyIndex(nodeGroup)
+        
+        dependents = {}
+        stack = [object]
+        
+        while stack:
+            
+            for dependent, relation in index.getDependents(stack.pop()):
+                
+                if dependent != object and dependent.name not in dependents:
+                    
+                    dependents[dependent.name] = relation
+                    
+                    if self.indirect:
+                        
+                        stack.append(dependent)
+        
+        searchIndex = getSearchIndex(nodeGroup)
+        
+        for otherNode in nodeGroup.nodes:
+            
+            otherNode.select = False
+        
+        node.select = True
+        
+        for dependentName in dependents:
+            
+            dependentNode = searchIndex.findNode(nodeGroup, ('OBJECT', scene.name, dependentName))
+            
+            if dependentNode:
+                
+                dependentNode.select = True
+        
+        names = sorted(dependents)
+        
+        if len(names) > 10:
+            
+            names = names[:10] + ["..."]
+        
+        self.report({'INFO'}, str(len(dependents))+" objects depend on "+object.name+(": "+", ".join(names) if names else ""))
+        
+        return {'FINISHED'}
+
+
+
+@persistent
+def autoSyncHandler(scene):
+    
+    global dataCountsSynced
+    
+    if not scene.graph_auto_sync:
+        
+        #Changes made meanwhile aren't tracked, so the next sync starts afresh
+        objectSignatures.clear()
+        
+        return
+    
+    if scene.graphing:
+        
+        return
+    
+    sceneTrees = getSceneTrees()
+    
+    if len(sceneTrees) == 0:
+        
+        return
+    
+    #Cheap checks first, so idle redraws don't walk the scene at all
+    counts = (len(bpy.data.scenes), len(bpy.data.objects), len(bpy.data.materials))
+    
+    fullSync = counts != dataCountsSynced
+    changedObjects = {}
+    
+    #Moving an object flags it as updated too, but only changes the graph if
+    #something the graph shows changed with it
+    if bpy.data.objects.is_updated:
+        
+        changedObjects = graphedObjectsChanged()
+    
+    if bpy.data.materials.is_updated:
+        
+        fullSync = graphedMaterialsChanged() or fullSync
+    
+    if fullSync:
+        
+        dataCountsSynced = counts
+        
+        with GraphingGuard():
+            
+            for nodeGroup in sceneTrees:
+                
+                syncGraph(nodeGroup)
+        
+    elif len(changedObjects) > 0:
+        
+        #Most edits only touch a few objects, so only their nodes are synced
+        with GraphingGuard():
+            
+            for nodeGroup in sceneTrees:
+                
+                if not syncObjects(nodeGroup, changedObjects):
+                    
+                    syncGraph(nodeGroup)
+
+
+dataCountsSynced = None
+
+#Object name -> what the graph shows of it when it was last checked
+objectSignatures = {}
+materialNames = set()
+
+
+
+def getObjectSignature(object):
+    
+    parentName = object.parent.name if object.parent else None
+    materials = tuple(materialSlot.material.name for materialSlot in object.material_slots if materialSlot.material)
+    targets = tuple(target.name for struct in list(object.modifiers) + list(object.constraints) for target in getObjectPointers(struct))
+    
+    return (parentName, object.type, materials, targets, tuple(object.layers), object.select)
+
+
+
+#Only looks at the objects Blender flagged, and keeps checking them all, so
+#every signature stays current. Returns {object name: (object, old signature)}
+#for the objects whose signature changed, with None for ones not seen before
+def graphedObjectsChanged():
+    
+    changedObjects = {}
+    
+    for object in bpy.data.objects:
+        
+        if object.is_updated or object.is_updated_data:
+            
+            signature = getObjectSignature(object)
+            oldSignature = objectSignatures.get(object.name)
+            
+            if oldSignature != signature:
+                
+                objectSignatures[object.name] = signature
+                changedObjects[object.name] = (object, oldSignature)
+    
+    return changedObjects
+
+
+
+#Material settings don't show in the graph, only new names do
+def graphedMaterialsChanged():
+    
+    changed = False
+    
+    for material in bpy.data.materials:
+        
+        if material.is_updated and material.name not in materialNames:
+            
+            materialNames.add(material.name)
+            changed = True
+    
+    return changed
+
+
+
+#(scene name, object name) of objects whose nodes were deleted. The ones no
+#scene uses any more are removed together once the editor action that deleted
+#the nodes has finished
+pendingDeletions = []
+
+
+
+def deletePendingObjects():
+    
+    deletions = list(pendingDeletions)
+    del pendingDeletions[:]
+    
+    #Like deleting in the viewport, the object only left the scene of the deleted
+    #node when the node was freed. Objects no scene uses any more go altogether
+    objects = set()
+    
+    for sceneName, objectName in deletions:
+        
+        object = bpy.data.objects.get(objectName)
+        
+        if object and len(object.users_scene) == 0:
+            
+            objects.add(object)
+    
+    if len(objects) == 0:
+        
+        return
+    
+    #Every tree showing the objects relinks their orphaned children
+    sceneTrees = [(nodeGroup, dict((getNodeKey(node), node) for node in nodeGroup.nodes)) for nodeGroup in getSceneTrees()]
+    
+    with GraphingGuard():
+        
+        #Children of deleted objects move up to their nearest ancestor that's staying,
+        #keeping their place in the world
+        for object in bpy.data.objects:
+            
+            if object.parent in objects and object not in objects:
+                
+                ancestor = object.parent
+                
+                while ancestor in objects:
+                    
+                    ancestor = ancestor.parent
+                
+                matrix = object.matrix_world.copy()
+                object.parent = ancestor
+                object.matrix_world = matrix
+                
+                for nodeGroup, nodesByKey in sceneTrees:
+                    
+                    relinkOrphanedNode(nodeGroup, nodesByKey, object, ancestor)
+        
+        for object in objects:
+            
+            for group in object.users_group:
+                
+                group.objects.unlink(object)
+            
+            bpy.data.objects.remove(object)
+    
+    pushDataUndo("Delete Objects")
+
+
+
+def relinkOrphanedNode(nodeGroup, nodesByKey, object, ancestor):
+    
+    for scene in object.users_scene:
+        
+        node = nodesByKey.get(('OBJECT', scene.name, object.name))
+        
+        if ancestor:
+            
+            parentNode = nodesByKey.get(('OBJECT', scene.name, ancestor.name))
+            
+        else:
+            
+            parentNode = nodesByKey.get(('SCENE', scene.name))
+        
+        if node and parentNode and len(node.inputs[0].links) == 0:
+            
+            linkParent(nodeGroup, node, parentNode)
+
+
+
+@persistent
+def deletePendingHandler(scene):
+    
+    if len(pendingDeletions) > 0:
+        
+        deletePendingObjects()
+
+
+
+#Names of node trees edited since the last update handler ran
+dirtyTrees = set()
+
+
+
+#Applies the parent links the user changed, once for all the updates a single
+#edit caused. Nodes whose parent link didn't change are skipped
+def applyParentLinks(nodeGroup):
+    
+    #One pass over the links, instead of asking every node for its own
+    parentLinks = {}
+    
+    for link in nodeGroup.links:
+        
+        if link.to_node.bl_idname == 'ObjectNodeType' and link.to_socket.identifier == "Parent":
+            
+            parentLinks.setdefault(link.to_node.as_pointer(), []).append(link.from_node)
+    
+    sceneNodes = {}
+    sceneObjects = {}
+    
+    for node in nodeGroup.nodes:
+        
+        if node.bl_idname == 'SceneNodeType':
+            
+            sceneNodes[node.sceneIndex] = node
+    
+    changedNodes = []
+    
+    for node in nodeGroup.nodes:
+        
+        if node.bl_idname != 'ObjectNodeType':
+            
+            continue
+        
+        parentNodes = parentLinks.get(node.as_pointer(), [])
+        
+        if len(parentNodes) == 1 and getLinkedParentName(parentNodes[0]) == node.linkedParent:
+            
+            continue
+        
+        changedNodes.append((node, parentNodes))
+    
+    if len(changedNodes) == 0:
+        
+        return
+    
+    with GraphingGuard():
+        
+        for node, parentNodes in changedNodes:
+            
+            scene = bpy.data.scenes.get(node.scene)
+            
+            if scene is None:
+                
+                continue
+            
+            if scene.name not in sceneObjects:
+                
+                sceneObjects[scene.name] = dict((object.name, object) for object in scene.objects)
+            
+            objects = sceneObjects[scene.name]
+            object = objects.get(node.objectIndex)
+            
+            if object is None:
+                
+                continue
+            
+            #If the object has been unlinked, link it to the scene node
+            if len(parentNodes) != 1:
+                
+                parent = None
+                
+                if scene.name in sceneNodes:
+                    
+                    linkParent(nodeGroup, node, sceneNodes[scene.name])
+                
+            else:
+                
+                parent = objects.get(getLinkedParentName(parentNodes[0]))
+                node.linkedParent = getLinkedParentName(parentNodes[0])
+            
+            if object.parent != parent:
+                
+                object.parent = parent
+    
+    pushDataUndo("Parent Objects")
+
+
+
+#After undo, redo or loading, the links are whatever the file held, so they're
+#taken as applied already. Applying them again would push a new undo step and
+#throw away the redo history
+def resetParentLinks(nodeGroup):
+    
+    parentLinks = {}
+    
+    for link in nodeGroup.links:
+        
+        if link.to_node.bl_idname == 'ObjectNodeType' and link.to_socket.identifier == "Parent":
+            
+            parentLinks.setdefault(link.to_node.as_pointer(), []).append(link.from_node)
+    
+    nodesByKey = dict((getNodeKey(node), node) for node in nodeGroup.nodes)
+    
+    with GraphingGuard():
+        
+        for node in nodeGroup.nodes:
+            
+            if node.bl_idname != 'ObjectNodeType':
+                
+                continue
+            
+            parentNodes = parentLinks.get(node.as_pointer(), [])
+            
+            if len(parentNodes) == 1:
+                
+                if node.linkedParent != getLinkedParentName(parentNodes[0]):
+                    
+                    node.linkedParent = getLinkedParentName(parentNodes[0])
+                
+                continue
+            
+            scene = bpy.data.scenes.get(node.scene)
+            object = scene.objects.get(node.objectIndex) if scene else None
+            
+            #Nodes that lost their parent link follow the object's parent instead,
+            #rather than the object losing its parent
+            if object and len(parentNodes) == 0:
+                
+                parentNode = nodesByKey.get(('OBJECT', scene.name, object.parent.name)) if object.parent else None
+                
+                if parentNode is None:
+                    
+                    parentNode = nodesByKey.get(('SCENE', scene.name))
+                
+                if parentNode:
+                    
+                    linkParent(nodeGroup, node, parentNode)
+
+
+
+@persistent
+def resetParentLinksHandler(*args):
+    
+    dirtyTrees.clear()
+    del pendingDeletions[:]
+    
+    for nodeGroup in getSceneTrees():
+        
+        resetParentLinks(nodeGroup)
+
+
+
+@persistent
+def applyParentLinksHandler(scene):
+    
+    #Deletions relink their own nodes, so wait until they're done
+    if len(dirtyTrees) == 0 or len(pendingDeletions) > 0 or scene.graphing:
+        
+        return
+    
+    treeNames = list(dirtyTrees)
+    dirtyTrees.clear()
+    
+    for treeName in treeNames:
+        
+        nodeGroup = bpy.data.node_groups.get(treeName)
+        
+        if nodeGroup and nodeGroup.bl_idname == 'SceneTreeType':
+            
+            applyParentLinks(nodeGroup)
+
+
+
+#The name fields on the nodes rename the datablock through these, so every node
+#showing it is pointed at the new name instead of losing it
+def renameNodes(nodeType, attribute, oldName, newName):
+    
+    for nodeGroup in getSceneTrees():
+        
+        for node in nodeGroup.nodes:
+            
+            if node.bl_idname == nodeType and getattr(node, attribute) == oldName:
+                
+                setattr(node, attribute, newName)
+                setNodeName(node, newName)
+    
+    invalidateReferences()
+
+
+
+def getSceneName(node):
+    
+    scene = getCachedReference(node, node.resolveScene)[0]
+    
+    return scene.name if scene else node.sceneIndex
+
+
+
+def setSceneName(node, name):
+    
+    scene = getCachedReference(node, node.resolveScene)[0]
+    
+    if scene and scene.name != name:
+        
+        oldName = scene.name
+        scene.name = name
+        
+        for nodeGroup in getSceneTrees():
+            
+            for objectNode in nodeGroup.nodes:
+                
+                if objectNode.bl_idname == 'ObjectNodeType' and objectNode.scene == oldName:
+                    
+                    objectNode.scene = scene.name
+        
+        renameNodes('SceneNodeType', "sceneIndex", oldName, scene.name)
 
-bpy.types.Scene.graph_filtering = bpy.props.BoolProperty(default=False)
 
 
-nodeTypes = ["mesh", "camera", "lamp", "armature", "curve", "lattice", "meta", "empty", "surface", "font", "speaker", "material"]
+def getObjectName(node):
+    
+    object = getCachedReference(node, node.resolveObject)[0]
+    
+    return object.name if object else node.objectIndex
 
-for node in nodeTypes:
+
+
+def setObjectName(node, name):
     
-    setattr(bpy.types.Scene, "graph_"+node+"_objects", bpy.props.BoolProperty(default=True))
+    object = getCachedReference(node, node.resolveObject)[0]
+    
+    if object and object.name != name:
+        
+        oldName = object.name
+        object.name = name
+        
+        renameNodes('ObjectNodeType', "objectIndex", oldName, object.name)
 
-bpy.types.Scene.graph_materials = bpy.props.BoolProperty(default=True)
 
 
+def getMaterialName(node):
+    
+    material = getCachedReference(node, node.resolveMaterial)[0]
+    
+    return material.name if material else node.materialIndex
 
-class GraphScene(bpy.types.Operator):
-    """Add a simple box mesh"""
-    bl_idname = "scene_nodes.graph_scene"
-    bl_label = "Add Box"
-    bl_options = {'REGISTER', 'UNDO'}
 
 
-    def execute(self, context):
-        
-        #Stops nodes from being deleted when nodes are cleared
-        context.scene.graphing = True
+def setMaterialName(node, name):
+    
+    material = getCachedReference(node, node.resolveMaterial)[0]
+    
+    if material and material.name != name:
         
-        nodeGroup = bpy.data.node_groups['NodeTree']
+        oldName = material.name
+        material.name = name
         
-        nodeGroup.nodes.clear()           
-
-
-        for sceneIndex, scene in enumerate(bpy.data.scenes):
-            
-            newSceneNode = nodeGroup.nodes.new('SceneNodeType')
-            newSceneNode.sceneIndex = scene.name
-            newSceneNode.select = False
-            newSceneNode.name = scene.name
-            newSceneNode.location[1] = sceneIndex * -newSceneNode.height
-            
-            #Only get objects that aren't children themselves
-            totalHeight = len([object for object in scene.objects if object.parent == None]) * -110
-            
-            yOffset = 0
-                                                  
-            for object in scene.objects:
-                
-                objectNotFiltered = getattr(scene, "graph_"+object.type.lower()+"_objects")
-                
-                if objectNotFiltered or not scene.graph_filtering:
-                
-                    newObjectNode = nodeGroup.nodes.new('ObjectNodeType')
-                    newObjectNode.objectIndex = object.name
-                    newObjectNode.scene = scene.name
-                    newObjectNode.select = False
-                    newObjectNode.name = object.name
-                    newObjectNode.use_custom_color = True
-                    newObjectNode.color = getattr(bpy.context.user_preferences.addons['sceneNodes'].preferences, object.type.lower()+"_node_colour")
-                   
-                    #print("Correct: Looking on object "+object.name+", node "+newObjectNode.name)
-                                                                    
-                    if object.type == "MESH":
-                                                
-                        newObjectNode.outputs.new('NodeSocketFloat', "Material")
-
-                           
-                    if object.parent == None:
-                        
-                        newObjectNode.location[1] = (yOffset * -140) - (totalHeight/2) + 12
-                        newObjectNode.location[0] = newSceneNode.width + 80
-                        
-                        nodeGroup.links.new(newObjectNode.inputs[0], newSceneNode.outputs[0])  
-                        
-                        yOffset = yOffset + 1
-                        
-                    else:
-                        
-                        parentName = object.parent.name
-                        
-                        parentNode = nodeGroup.nodes[parentName]
-                        
-                        if len(parentNode.outputs['Child'].links) == 0:
-                            
-                            newObjectNode.location[1] = parentNode.location[1]
-                            
-                        else:
-                            
-                            totalChildren = len(parentNode.outputs['Child'].links)
-                            
-                            lastChild = parentNode.outputs['Child'].links[totalChildren-1].to_node
-                            
-                            newObjectNode.location[1] = lastChild.location[1] - 140
-                            
-                        newObjectNode.location[0] = parentNode.location[0] + newObjectNode.width + 120
-                        
-                        nodeGroup.links.new(newObjectNode.inputs[0], parentNode.outputs[0])
-                     
-                     
-                    if scene.graph_materials or not scene.graph_filtering:
-                    
-                        for materialSlot in object.material_slots:
-                            
-                            if materialSlot.material:
-                            
-                                #print("Looking on object "+object.name+", node "+newObjectNode.name)
-                            
-                                objectMaterial = materialSlot.material
-                                                                    
-                                for material in bpy.data.materials:
-                                    
-                                    if objectMaterial.name == material.name:
-                                                                    
-                                        #If material node doesn't already exist
-                                        if material.name not in nodeGroup.nodes:
-                                                                                                    
-                                            newMaterialNode = nodeGroup.nodes.new('MaterialNodeType')
-                                            newMaterialNode.materialIndex = material.name
-                                            newMaterialNode.select = False
-                                            newMaterialNode.location[1] = newObjectNode.location[1]
-                                            newMaterialNode.location[0] = newObjectNode.location[0] + newObjectNode.width + 120
-                                            newMaterialNode.name = material.name                                
-                                            newMaterialNode.use_custom_color = True                   
-                                            #Have to use getattr as it "doesn't support ID properties"
-                                            newMaterialNode.color = getattr(bpy.context.user_preferences.addons['sceneNodes'].preferences, "material_node_colour")
-                                        
-                                            input = newMaterialNode.inputs[0]
-                                                                
-                                        else:
-                                            
-                                            input = nodeGroup.nodes[material.name].inputs[0]                  
-                                
-                                    print(newObjectNode.name)
-                                    nodeGroup.links.new(input, newObjectNode.outputs[1])
-                                                       
-                            
-        context.scene.graphing = False
-            
-        return {'FINISHED'}
+        renameNodes('MaterialNodeType', "materialIndex", oldName, material.name)
 
 
 
@@ -165,6 +3723,26 @@ class SceneTree(NodeTree):
     bl_idname = 'SceneTreeType'
     bl_label = 'Scene'
     bl_icon = 'SCENE_DATA'
+    
+    show_statistics = bpy.props.BoolProperty(name="Statistics", description="Show geometry and memory statistics on the nodes. Gathering them slows graphing down the first time", default=False)
+    colour_mode = bpy.props.EnumProperty(name="Colours", description="What node colours show", items=[
+        ("TYPE", "Type", "Colour nodes by object type"),
+        ("TRIANGLES", "Triangles", "Heatmap of evaluated triangle counts"),
+        ("MEMORY", "Memory", "Heatmap of evaluated mesh and texture memory"),
+        ], default="TYPE")
+    scope = bpy.props.EnumProperty(name="Scope", description="Which scenes this tree graphs", items=[
+        ("ALL", "All Scenes", "Graph every scene in the file"),
+        ("SCENE", "One Scene", "Graph a single scene, or the active one if none is chosen"),
+        ("SCENES", "Listed Scenes", "Graph the scenes named in a comma separated list"),
+        ], default="ALL")
+    scope_scene = bpy.props.StringProperty(name="Scene", description="Scene graphed by this tree")
+    scope_scenes = bpy.props.StringProperty(name="Scenes", description="Comma separated names of the scenes graphed by this tree")
+    dependency_edges = bpy.props.EnumProperty(name="Dependencies", description="Which dependencies between objects are drawn as links", items=[(relation, label, description) for relation, label, description, socketType in dependencyTypes], options={'ENUM_FLAG'}, default=set())
+    
+    
+    def update(self):
+        
+        dirtyTrees.add(self.name)
 
 
 # Mix-in class for all custom nodes in this tree type.
@@ -183,6 +3761,7 @@ class SceneNode(Node, MyCustomTreeNode):
     bl_icon = 'SCENE_DATA'
 
     sceneIndex = bpy.props.StringProperty()
+    sceneName = bpy.props.StringProperty(name="Name", get=getSceneName, set=setSceneName)
 
 
     # === Optional Functions ===
@@ -197,24 +3776,51 @@ class SceneNode(Node, MyCustomTreeNode):
 
     # Copy function to initialize a copied node from an existing one.
     def copy(self, node):
-        print("Copying from node ", node)
+        log("DEBUG", "Copying from node ", node)
         
         bpy.data.scenes.new("Scene")
         self.sceneIndex = self.sceneIndex + 1
 
     # Free function to clean up on removal.
     def free(self):
-        print("Removing node ", self, ", Goodbye!")
+        log("DEBUG", "Removing node ", self, ", Goodbye!")
+        
+        referenceCache.pop(self.as_pointer(), None)
         
         #Don't delete scene if node is deleted during graphing and scene isn't last scene
         if len(bpy.data.scenes) > 0 and not bpy.context.scene.graphing:
             
-            bpy.data.scenes.remove(bpy.data.scenes[self.sceneIndex])
+            scene = bpy.data.scenes.get(self.sceneIndex)
+            
+            if scene:
+                
+                bpy.data.scenes.remove(scene)
+                invalidateReferences()
 
     # Additional buttons displayed on the node.
     def draw_buttons(self, context, layout):
-
-        layout.prop(bpy.data.scenes[self.sceneIndex], "name", text="", icon="SCENE_DATA")
+        
+        scene, icon = getCachedReference(self, self.resolveScene)
+        
+        if scene:
+            
+            layout.prop(self, "sceneName", text="", icon=icon)
+            
+        else:
+            
+            layout.label(text=self.sceneIndex+" is missing", icon=icon)
+    
+    
+    def resolveScene(self):
+        
+        scene = bpy.data.scenes.get(self.sceneIndex)
+        
+        #Deleted, or renamed somewhere other than the node
+        if scene is None:
+            
+            return None, "ERROR"
+        
+        return scene, "SCENE_DATA"
 
     # Detail buttons in the sidebar.
     # If this function is not defined, the draw_buttons function is used instead
@@ -237,8 +3843,23 @@ class ObjectNode(Node, MyCustomTreeNode):
     bl_icon = 'OBJECT_DATA'
 
     objectIndex = bpy.props.StringProperty()
+    objectName = bpy.props.StringProperty(name="Name", get=getObjectName, set=setObjectName)
     scene = bpy.props.StringProperty()
     
+    #Object name of the parent node this node was last linked to, "" for the scene node
+    linkedParent = bpy.props.StringProperty()
+    
+    #Filled in when the tree shows statistics
+    vertexCount = bpy.props.IntProperty(default=0)
+    faceCount = bpy.props.IntProperty(default=0)
+    triangleCount = bpy.props.IntProperty(default=0)
+    modifierCount = bpy.props.IntProperty(default=0)
+    memoryKiB = bpy.props.IntProperty(default=0)
+    
+    #Collapsed nodes don't have nodes for their children until they're expanded
+    childrenShown = bpy.props.BoolProperty(default=True)
+    hiddenChildren = bpy.props.IntProperty(default=0)
+    
     def init(self, context):
                 
         self.inputs.new('NodeSocketFloat', "Parent")
@@ -247,39 +3868,22 @@ class ObjectNode(Node, MyCustomTreeNode):
 
     def update(self):
         
-        scene = bpy.data.scenes[self.scene]
-        
-        if not scene.graphing:
-        
-            #print("updating node: ", self.name, len(self.inputs[0].links))
-            
-            #If the object has been unlinked, link it to the scene node
-            if len(self.inputs[0].links) != 1:
-                            
-                scene.objects[self.objectIndex].parent = None
-                            
-                nodeGroup = bpy.data.node_groups['NodeTree']
-                
-                nodeGroup.links.new(self.inputs[0], nodeGroup.nodes[scene.name].outputs[0])  
-                
-            else:
-                
-                parentName = self.inputs[0].links[0].from_node.name
-                                        
-                #print(parentName)
-                
-                if parentName != "Scene":
-                
-                    scene.objects[self.objectIndex].parent = scene.objects[parentName]
+        #Every node is updated whenever anything in the tree changes, so only
+        #note that the tree needs checking and deal with it once per event
+        dirtyTrees.add(self.id_data.name)
         
 
     # Copy function to initialize a copied node from an existing one.
     def copy(self, node):
-        print("Copying from node ", node)
+        log("DEBUG", "Copying from node ", node)
         
-        scene = bpy.data.scenes[self.scene]
+        object = self.resolveObject()[0]
+        
+        if object is None:
+            
+            return
         
-        object = scene.objects[self.objectIndex]
+        scene = bpy.data.scenes[self.scene]
                         
         if object.type == "CAMERA":
             
@@ -291,9 +3895,9 @@ class ObjectNode(Node, MyCustomTreeNode):
             scene.update()
             
             #Link new node with parent of original node
-            nodeGroup = bpy.data.node_groups['NodeTree']
+            nodeGroup = self.id_data
             oldParentNode = nodeGroup.nodes[object.name].inputs[0].links[0].from_node   
-            nodeGroup.links.new(self.inputs[0], oldParentNode.outputs[0])
+            linkParent(nodeGroup, self, oldParentNode)
             
             #Set properties for new node
             self.name = newObject.name
@@ -303,29 +3907,73 @@ class ObjectNode(Node, MyCustomTreeNode):
     # Free function to clean up on removal.
     def free(self):
         
-        scene = bpy.data.scenes[self.scene]
+        referenceCache.pop(self.as_pointer(), None)
         
-        if not scene.graphing:
-             
-            scene = bpy.data.scenes[self.scene]
+        scene = bpy.data.scenes.get(self.scene)
+        
+        if scene and not scene.graphing:
+            
+            object = scene.objects.get(self.objectIndex)
+            
+            #Unlinked straight away, so the node editor's undo step has the node
+            #and the object going together
+            if object:
+                
+                scene.objects.unlink(object)
             
-            scene.objects[self.objectIndex].select = True
-            bpy.ops.object.delete()
+            #Deleting a box selection frees many nodes at once, so objects no
+            #scene uses are removed in one batch afterwards
+            pendingDeletions.append((scene.name, self.objectIndex))
             
-            print("Removing node ", self, ", Goodbye!")
+            log("DEBUG", "Removing node ", self, ", Goodbye!")
 
     # Additional buttons displayed on the node.
     def draw_buttons(self, context, layout):
         
-        scene = bpy.data.scenes[self.scene]
-        
-        if scene.objects[self.objectIndex].type == "SPEAKER":
+        object, icon = getCachedReference(self, self.resolveObject)
         
-            layout.prop(scene.objects[self.objectIndex], "name", text="", icon=scene.objects[self.objectIndex].type)
+        if object:
+            
+            layout.prop(self, "objectName", text="", icon=icon)
             
         else:
             
-            layout.prop(scene.objects[self.objectIndex], "name", text="", icon=scene.objects[self.objectIndex].type+"_DATA")
+            layout.label(text=self.objectIndex+" is missing", icon=icon)
+        
+        if self.id_data.show_statistics:
+            
+            column = layout.column(align=True)
+            column.label(text=str(self.vertexCount)+" verts, "+str(self.faceCount)+" faces")
+            column.label(text=str(self.modifierCount)+" modifiers, "+formatMemory(self.memoryKiB))
+        
+        if self.hiddenChildren > 0:
+            
+            operator = layout.operator("scene_nodes.expand_node", text="+"+str(self.hiddenChildren)+" children", icon="DISCLOSURE_TRI_RIGHT")
+            
+            operator.node_name = self.name
+            
+            operator.tree_name = self.id_data.name
+            
+        elif len(self.outputs[0].links) > 0:
+            
+            operator = layout.operator("scene_nodes.collapse_node", text="Fold", icon="DISCLOSURE_TRI_DOWN")
+            
+            operator.node_name = self.name
+            
+            operator.tree_name = self.id_data.name
+    
+    
+    def resolveObject(self):
+        
+        scene = bpy.data.scenes.get(self.scene)
+        object = scene.objects.get(self.objectIndex) if scene else None
+        
+        #Deleted, unlinked from the scene, or renamed somewhere other than the node
+        if object is None:
+            
+            return None, "ERROR"
+        
+        return object, getObjectIcon(object)
 
 
     # Detail buttons in the sidebar.
@@ -349,12 +3997,20 @@ class MaterialNode(Node, MyCustomTreeNode):
     bl_icon = 'MATERIAL_DATA'
 
     materialIndex = bpy.props.StringProperty()
+    materialName = bpy.props.StringProperty(name="Name", get=getMaterialName, set=setMaterialName)
+    
+    userCount = bpy.props.IntProperty(default=0)
+    #Bundled materials aren't linked to their users unless linksShown is set
+    bundled = bpy.props.BoolProperty(default=False)
+    linksShown = bpy.props.BoolProperty(default=False)
+    
+    textureMemoryKiB = bpy.props.IntProperty(default=0)
 
 
     def init(self, context):
                 
         self.inputs.new('NodeSocketFloat', "Object")
-        self.inputs[0].link_limit = 9999
+        self.inputs[0].link_limit = MAX_MATERIAL_LINKS
         
         
 #    def update(self):
@@ -364,17 +4020,61 @@ class MaterialNode(Node, MyCustomTreeNode):
     # Copy function to initialize a copied node from an existing one.
     def copy(self, node):
         
-        print("Copying from node ", node)
+        log("DEBUG", "Copying from node ", node)
  
     # Free function to clean up on removal.
     def free(self):
         
-        print("Removing node ", self, ", Goodbye!")
+        referenceCache.pop(self.as_pointer(), None)
+        
+        log("DEBUG", "Removing node ", self, ", Goodbye!")
 
     # Additional buttons displayed on the node.
     def draw_buttons(self, context, layout):
-
-        layout.prop(bpy.data.materials[self.materialIndex], "name", text="", icon="MATERIAL_DATA")
+        
+        material, icon = getCachedReference(self, self.resolveMaterial)
+        
+        if material:
+            
+            layout.prop(self, "materialName", text="", icon=icon)
+            
+        else:
+            
+            layout.label(text=self.materialIndex+" is missing", icon=icon)
+        
+        if self.id_data.show_statistics:
+            
+            layout.label(text=formatMemory(self.textureMemoryKiB)+" of textures")
+        
+        if self.bundled:
+            
+            if self.linksShown:
+                
+                operator = layout.operator("scene_nodes.hide_material_links", text=str(self.userCount)+" users", icon="DISCLOSURE_TRI_DOWN")
+                
+                operator.node_name = self.name
+                
+                operator.tree_name = self.id_data.name
+                
+            else:
+                
+                operator = layout.operator("scene_nodes.show_material_links", text=str(self.userCount)+" users", icon="DISCLOSURE_TRI_RIGHT")
+                
+                operator.node_name = self.name
+                
+                operator.tree_name = self.id_data.name
+    
+    
+    def resolveMaterial(self):
+        
+        material = bpy.data.materials.get(self.materialIndex)
+        
+        #Deleted, or renamed somewhere other than the node
+        if material is None:
+            
+            return None, "ERROR"
+        
+        return material, "MATERIAL_DATA"
 
     # Detail buttons in the sidebar.
     # If this function is not defined, the draw_buttons function is used instead
@@ -425,8 +4125,44 @@ def SceneNodesHeader(self, context):
     
     layout = self.layout
     
-    row = layout.row()
+    row = layout.row(align=True)
     row.operator("scene_nodes.graph_scene", text="Graph Scene")
+    row.operator("scene_nodes.graph_scene_background", text="", icon="TIME")
+    row.operator("scene_nodes.sync_graph", text="", icon="FILE_REFRESH")
+    row.prop(context.scene, "graph_auto_sync", text="", icon="AUTO")
+    row.prop(context.scene, "graph_depth_limit", text="Depth")
+    row.operator("scene_nodes.find_node", text="", icon="VIEWZOOM")
+    row.operator("scene_nodes.find_dependents", text="", icon="LINKED")
+    
+    nodeGroup = context.space_data.node_tree
+    
+    if nodeGroup and nodeGroup.bl_idname == 'SceneTreeType':
+        
+        row = layout.row(align=True)
+        row.prop(nodeGroup, "scope", text="")
+        
+        if nodeGroup.scope == 'SCENE':
+            
+            row.prop_search(nodeGroup, "scope_scene", bpy.data, "scenes", text="")
+            
+        elif nodeGroup.scope == 'SCENES':
+            
+            row.prop(nodeGroup, "scope_scenes", text="")
+        
+        row = layout.row(align=True)
+        row.prop(nodeGroup, "dependency_edges")
+        
+        row = layout.row(align=True)
+        row.prop(nodeGroup, "show_statistics", text="", icon="INFO")
+        
+        if nodeGroup.show_statistics:
+            
+            row.prop(nodeGroup, "colour_mode", text="")
+    
+    if context.window_manager.graph_running:
+        
+        row = layout.row()
+        row.label(text="Graphing: "+str(int(context.window_manager.graph_progress * 100))+"% (Esc to cancel)")
     
     row = layout.row(align=True)    
     row.prop(context.scene, "graph_filtering", text="", icon="FILTER")
@@ -442,6 +4178,13 @@ def SceneNodesHeader(self, context):
         row.prop(context.scene, "graph_speaker_objects", text="", toggle=True, icon="SPEAKER")
         row.prop(context.scene, "graph_materials", text="", toggle=True, icon="MATERIAL_DATA")
         
+        row = layout.row(align=True)
+        row.prop(context.scene, "graph_name_filter", text="", icon="VIEWZOOM")
+        row.prop_search(context.scene, "graph_group_filter", bpy.data, "groups", text="", icon="GROUP")
+        row.prop(context.scene, "graph_selected_only", text="", toggle=True, icon="RESTRICT_SELECT_OFF")
+        row.prop(context.scene, "graph_visible_layers_only", text="", toggle=True, icon="RENDERLAYERS")
+        row.prop(context.scene, "graph_parent_chain", text="", toggle=True, icon="CONSTRAINT")
+        
 
 
 class SceneNodesPreferences(bpy.types.AddonPreferences):
@@ -461,6 +4204,13 @@ class SceneNodesPreferences(bpy.types.AddonPreferences):
     speaker_node_colour = bpy.props.FloatVectorProperty(subtype="COLOR", min=0, max=1, default= [0.000000, 0.630769, 0.542676])
     material_node_colour = bpy.props.FloatVectorProperty(subtype="COLOR", min=0, max=1, default=[1.000000, 0.608448, 0.993887])
     
+    material_bundle_threshold = bpy.props.IntProperty(name="Bundle Materials Above", description="Materials with more users than this show a user count instead of a link from each user, 0 always links", default=100, min=0)
+    undo_graphing = bpy.props.BoolProperty(name="Undoable Graphing", description="Add an undo step every time the graph is built or changed. Each step keeps a copy of the tree, which adds up quickly with large scenes", default=False)
+    
+    profile_graphing = bpy.props.BoolProperty(name="Profile Graphing", description="Time each phase of graphing, report it and append it to the profile log", default=False)
+    profile_log_path = bpy.props.StringProperty(name="Profile Log", description="JSON Lines file profiles are appended to. When empty, the temporary directory from the file paths preferences is used, or the .blend file's directory", subtype="FILE_PATH", default="")
+    log_level = bpy.props.EnumProperty(name="Log Level", description="How much is printed to the console", items=[("ERROR", "Errors", ""), ("INFO", "Info", ""), ("DEBUG", "Debug", "")], default="ERROR", update=updateLogLevel)
+    
         
     def draw(self, context):
         layout = self.layout
@@ -478,7 +4228,180 @@ class SceneNodesPreferences(bpy.types.AddonPreferences):
                 row = layout.row()
                 row.prop(self, node+"_node_colour", text=node.capitalize()+" node")
                 row.prop(self, nodeTypes[nodeIndex+1]+"_node_colour", text=nodeTypes[nodeIndex+1].capitalize()+" node")
+        
+        row = layout.row()
+        row.prop(self, "material_bundle_threshold")
+        row.prop(self, "undo_graphing")
+        
+        row = layout.row()
+        row.label(text="Debugging:")
+        
+        row = layout.row()
+        row.prop(self, "profile_graphing")
+        row.prop(self, "log_level")
+        
+        row = layout.row()
+        row.active = self.profile_graphing
+        row.prop(self, "profile_log_path")
+            
+
+### Export ###
+# Streams the scene -> object -> material graph to a file without creating any
+# nodes, for running over many files in background mode:
+#
+#   blender -b file.blend --python sceneNodes.py -- --output graph.jsonl.gz
+#
+# Records are written as they're found, so memory use doesn't grow with the file.
+
+#Bump when records change in a way that would break readers
+EXPORT_SCHEMA_VERSION = 1
+
+#Every record has a "type" and the fields listed for it
+EXPORT_SCHEMA = {
+    "header": ["schema", "file"],
+    "scene": ["id", "name"],
+    "object": ["id", "name", "object_type"],
+    "material": ["id", "name"],
+    "root": ["source", "target", "scene"],
+    "parent": ["source", "target"],
+    "material_link": ["source", "target"],
+    }
+
+
+
+def iterGraphRecords():
+    
+    yield {"type": "header", "schema": EXPORT_SCHEMA_VERSION, "file": bpy.data.filepath}
+    
+    #Objects and materials are shared between scenes but only written once
+    writtenObjects = set()
+    writtenMaterials = set()
+    
+    for scene in bpy.data.scenes:
+        
+        sceneId = "scene:"+scene.name
+        
+        yield {"type": "scene", "id": sceneId, "name": scene.name}
+        
+        for object in scene.objects:
+            
+            objectId = "object:"+object.name
+            
+            if object.name not in writtenObjects:
+                
+                writtenObjects.add(object.name)
+                
+                yield {"type": "object", "id": objectId, "name": object.name, "object_type": object.type}
+                
+                if object.parent:
+                    
+                    yield {"type": "parent", "source": "object:"+object.parent.name, "target": objectId}
+                
+                linkedMaterials = set()
+                
+                for materialSlot in object.material_slots:
+                    
+                    material = materialSlot.material
+                    
+                    if material is None or material.name in linkedMaterials:
+                        
+                        continue
+                    
+                    linkedMaterials.add(material.name)
+                    
+                    if material.name not in writtenMaterials:
+                        
+                        writtenMaterials.add(material.name)
+                        
+                        yield {"type": "material", "id": "material:"+material.name, "name": material.name}
+                    
+                    yield {"type": "material_link", "source": objectId, "target": "material:"+material.name}
+            
+            if object.parent == None:
+                
+                yield {"type": "root", "source": sceneId, "target": objectId, "scene": scene.name}
+
+
+
+def writeJsonLines(records, file):
+    
+    for record in records:
+        
+        file.write(json.dumps(record, sort_keys=True)+"\n")
+
+
+
+def writeGraphML(records, file):
+    
+    file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    file.write('<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+    
+    for key in ("type", "name", "object_type", "scene"):
+        
+        file.write('  <key id="'+key+'" for="all" attr.name="'+key+'" attr.type="string"/>\n')
+    
+    file.write('  <graph id="scene_nodes" edgedefault="directed">\n')
+    
+    for record in records:
+        
+        if record["type"] == "header":
+            
+            file.write('    <desc>'+quoteattr("schema "+str(record["schema"])+", "+record["file"])[1:-1]+'</desc>\n')
+            
+            continue
+        
+        data = "".join('<data key="'+key+'">'+quoteattr(record[key])[1:-1]+'</data>' for key in ("type", "name", "object_type", "scene") if key in record)
+        
+        if "id" in record:
+            
+            file.write('    <node id='+quoteattr(record["id"])+'>'+data+'</node>\n')
+            
+        else:
             
+            file.write('    <edge source='+quoteattr(record["source"])+' target='+quoteattr(record["target"])+'>'+data+'</edge>\n')
+    
+    file.write('  </graph>\n')
+    file.write('</graphml>\n')
+
+
+
+exportWriters = {"JSONL": writeJsonLines, "GRAPHML": writeGraphML}
+
+
+
+def exportSceneGraph(path, format="JSONL", compress=None):
+    
+    if compress is None:
+        
+        compress = path.endswith(".gz")
+    
+    if compress:
+        
+        file = gzip.open(path, "wt", encoding="utf-8")
+        
+    else:
+        
+        file = open(path, "w", encoding="utf-8")
+    
+    with file:
+        
+        exportWriters[format](iterGraphRecords(), file)
+
+
+
+def exportMain():
+    
+    argv = sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else []
+    
+    parser = argparse.ArgumentParser(description="Export the scene graph of a .blend file")
+    parser.add_argument("--output", required=True, help="File to write, compressed when it ends in .gz")
+    parser.add_argument("--format", choices=sorted(exportWriters), default="JSONL")
+    parser.add_argument("--gzip", action="store_true", help="Compress the output whatever its name")
+    args = parser.parse_args(argv)
+    
+    exportSceneGraph(args.output, args.format, args.gzip or None)
+
+
 
 def register():
 
@@ -493,6 +4416,17 @@ def register():
         nodeitems_utils.unregister_node_categories("SCENE_NODES")
     nodeitems_utils.register_node_categories("SCENE_NODES", node_categories)
     
+    bpy.app.handlers.scene_update_post.append(autoSyncHandler)
+    bpy.app.handlers.scene_update_post.append(checkReferencesHandler)
+    bpy.app.handlers.scene_update_post.append(checkDependenciesHandler)
+    bpy.app.handlers.scene_update_post.append(deletePendingHandler)
+    bpy.app.handlers.scene_update_post.append(applyParentLinksHandler)
+    
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        
+        handlers.append(invalidateReferencesHandler)
+        handlers.append(resetParentLinksHandler)
+    
 
 def unregister():
     
@@ -503,9 +4437,36 @@ def unregister():
     
     nodeitems_utils.unregister_node_categories("SCENE_NODES")
     
+    if autoSyncHandler in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.remove(autoSyncHandler)
+    
+    if checkReferencesHandler in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.remove(checkReferencesHandler)
+    
+    if checkDependenciesHandler in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.remove(checkDependenciesHandler)
+    
+    if deletePendingHandler in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.remove(deletePendingHandler)
+    
+    if applyParentLinksHandler in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.remove(applyParentLinksHandler)
+    
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        
+        if invalidateReferencesHandler in handlers:
+            handlers.remove(invalidateReferencesHandler)
+        
+        if resetParentLinksHandler in handlers:
+            handlers.remove(resetParentLinksHandler)
+    
 #if __name__ == "__main__":
 #    register()
 #    
 
+#Running the file in background mode exports the graph instead of registering
+if __name__ == "__main__" and bpy.app.background:
+    exportMain()
+
 #register()    
 #bpy.types.NODE_HT_header.append(SceneNodesHeader)    